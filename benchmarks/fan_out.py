@@ -0,0 +1,132 @@
+"""Compares channel fan-out the old way (the line formatted, sanitized and
+queued as a string separately for every member) against broadcast() and the
+shared, encoded once lines it queues, for channels of 20 to 1000 members.
+
+Covers a PRIVMSG to the channel, a channel UTM, and the BCAST of a SETCKEY. The
+old way isn't even charged for encoding every members queue before sending.
+
+Run it from the top of the repository with `python benchmarks/fan_out.py`.
+"""
+from __future__ import annotations
+from typing import Dict, List, Tuple
+
+from harness import connect, drain, make_server, measure
+from source.channel import Channel
+from source.commands.channel import setclientkey_handler
+from source.commands.channel_or_session import utm_handler
+from source.connected_client import ConnectedClient
+from source.irc_helpers import IRCStatusCode
+from source.pkg4.encoding import dwc_decode, dwc_encode
+from source.pkg4.user_message import UTMMessage
+
+MEMBERS = (20, 100, 1000)
+UTM = "0 6 B A 1 _  " + dwc_encode(bytes(40))
+USER_KEY = "\\b_lib_u_user\\" + dwc_encode(bytes(150))
+
+# Client --> What the old code had queued up for it.
+old_writebuffers: Dict[ConnectedClient, str] = {}
+# (Nickname, Key) --> Value, the way SETCKEY used to keep client keys.
+old_client_keys: Dict[Tuple[str, str], str] = {}
+
+
+def old_add_to_write_buffer(client: ConnectedClient, msg: str) -> None:
+    """ConnectedClient.raw_add_to_write_buffer() before broadcast()."""
+    old_writebuffers[client] = (
+        old_writebuffers.get(client, "")
+        + msg.replace("\r\n", "").replace("\n", "")
+        + "\r\n"
+    )
+
+
+def old_reply(
+    client: ConnectedClient, status: IRCStatusCode, params: List[str], trailing: str
+) -> None:
+    """ConnectedClient.reply() before format_reply()."""
+    message = f":s {str(status.value).zfill(3)}"
+    for parameter in params:
+        message += f" {parameter.rstrip()}"
+    if trailing:
+        message += f" :{trailing.rstrip()}"
+    old_add_to_write_buffer(client, message)
+
+
+def old_privmsg(client: ConnectedClient, channel: Channel, text: str) -> None:
+    """ConnectedClient.message_channel() before broadcast()."""
+    line = ":%s %s %s" % (client.get_prefix(), "PRIVMSG", f"{channel.name} :{text}")
+    for member in channel.members:
+        if member != client:
+            old_add_to_write_buffer(member, line)
+
+
+def old_channel_utm(client: ConnectedClient, arguments: List[str]) -> None:
+    """utm_handler() for a channel, before broadcast()."""
+    UTMMessage(arguments[1])
+    channel = client.channels[arguments[0]]
+    for i in range(0, len(list(channel.members))):
+        old_add_to_write_buffer(
+            list(channel.members)[i],
+            f":{client.get_prefix()} UTM {arguments[0]} :{arguments[1]}",
+        )
+
+
+def old_setckey(client: ConnectedClient, arguments: List[str]) -> None:
+    """setclientkey_handler() for `\\b_lib_u_user`, before broadcast()."""
+    channel = client.channels[arguments[0]]
+    value = arguments[2][14:]
+    dwc_decode(value)
+    old_client_keys[(client.nickname or "", "user")] = value
+    for i in range(0, len(list(channel.members))):
+        old_reply(
+            list(channel.members)[i],
+            IRCStatusCode.SuccessfulClientKeyOp,
+            [arguments[0], arguments[0], arguments[1], "BCAST"],
+            arguments[2],
+        )
+
+
+def main() -> None:
+    print("members  PRIVMSG old/new (us)    UTM #chan old/new    SETCKEY old/new")
+    for members in MEMBERS:
+        server = make_server()
+        clients = [connect(server, f"Player{i}", "#plaza") for i in range(members)]
+        drain(server)
+        sender = clients[0]
+        channel = server.channels["#plaza"]
+        number = max(10, 10000 // members)
+
+        def reset() -> None:
+            drain(server)
+            old_writebuffers.clear()
+
+        def new_setckey() -> None:
+            setclientkey_handler("SETCKEY", ["#plaza", "Player0", USER_KEY], sender)
+            # What the end of the loop iteration would do.
+            channel.flush_key_broadcasts()
+
+        timings = [
+            measure(lambda: old_privmsg(sender, channel, "hello"), number, reset),
+            measure(
+                lambda: sender.message_channel(channel, "PRIVMSG", "#plaza :hello"),
+                number,
+                reset,
+            ),
+            measure(lambda: old_channel_utm(sender, ["#plaza", UTM]), number, reset),
+            measure(lambda: utm_handler("UTM", ["#plaza", UTM], sender), number, reset),
+            measure(
+                lambda: old_setckey(sender, ["#plaza", "Player0", USER_KEY]),
+                number,
+                reset,
+            ),
+            measure(new_setckey, number, reset),
+        ]
+        print(
+            f"{members:7d}  "
+            + "   ".join(
+                f"{old:8.1f} / {new:7.1f}"
+                for (old, new) in zip(timings[::2], timings[1::2])
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""A real Server with real clients connected over loopback, for the benchmarks
+to drive directly, without any event loop in between."""
+from __future__ import annotations
+from pathlib import Path
+from timeit import default_timer
+from typing import Callable, List
+import os
+import socket
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from loguru import logger  # noqa: E402
+from source.connected_client import ConnectedClient  # noqa: E402
+from source.miniircd import parse_options  # noqa: E402
+from source.selector_engine import SelectorEngine  # noqa: E402
+from source.server import Server  # noqa: E402
+
+# The other ends of every client's connection, kept open.
+PEERS: List[socket.socket] = []
+LISTENER = socket.socket()
+LISTENER.bind(("127.0.0.1", 0))
+LISTENER.listen(128)
+
+
+def make_server(*argv: str) -> Server:
+    # Nothing here gets sent, so SendQ limits would only get in the way.
+    argv = ("--sendq-soft-limit", "1048576", "--sendq-hard-limit", "1048576") + argv
+    if os.getuid() == 0:
+        argv += ("--setuid", "root")
+    logger.remove()
+    server = Server(parse_options(list(argv)))
+    server.engine = SelectorEngine(server)
+    return server
+
+
+def connect(server: Server, nickname: str, *channels: str) -> ConnectedClient:
+    """Connects, registers and joins `channels` as `nickname`."""
+    PEERS.append(socket.create_connection(LISTENER.getsockname()))
+    (conn, addr) = LISTENER.accept()
+    server.engine.add_client(conn, addr)
+    client = server.clients[conn]
+    client.handle_line(f"NICK {nickname}")
+    client.handle_line(f"USER {nickname} 0 * :{nickname}")
+    for channel in channels:
+        client.handle_line(f"JOIN {channel}")
+    return client
+
+
+def drain(server: Server) -> None:
+    """Throws away everything queued up to be sent. Timers are left alone, or
+    the clients would eventually get disconnected for never answering a PING."""
+    for client in server.clients.values():
+        client.take_write_queue()
+
+
+def measure(function: Callable[[], object], number: int, reset: Callable[[], None]):
+    """Microseconds per call, best of five."""
+    best = float("inf")
+    for _ in range(5):
+        start = default_timer()
+        for _ in range(number):
+            function()
+        best = min(best, default_timer() - start)
+        reset()
+    return best / number * 1e6
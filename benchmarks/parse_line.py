@@ -0,0 +1,121 @@
+"""Compares parsing and dispatching recorded peerchat lines the old way (a
+split chain, and a handler table rebuilt for every command) against
+parse_line(), Message and the prebuilt COMMAND_HANDLERS table.
+
+Run it from the top of the repository with `python benchmarks/parse_line.py`.
+"""
+from __future__ import annotations
+from pathlib import Path
+from timeit import repeat
+from typing import Callable, Dict, List, Tuple
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from source.connected_client import COMMAND_HANDLERS  # noqa: E402
+from source.message import parse_line  # noqa: E402
+
+LINES = (Path(__file__).parent / "peerchat_lines.txt").read_text().splitlines()
+# How many lines every timing runs through.
+ROUNDS = 200000
+
+
+def noop_handler(command: str, arguments: List[str], client: None) -> None:
+    pass
+
+
+# Command --> Handler, the same commands without having to set up a client.
+HANDLERS: Dict[str, Callable[[str, List[str], None], None]] = {
+    command: noop_handler for command in COMMAND_HANDLERS
+}
+
+
+def old_parse(line: str) -> Tuple[str, List[str]]:
+    """ConnectedClient.handle_line() before parse_line()."""
+    x = line.split(" ", 1)
+    command = x[0].upper()
+    if len(x) == 1:
+        arguments = []
+    else:
+        if len(x[1]) > 0 and x[1][0] == ":":
+            arguments = [x[1][1:]]
+        else:
+            y = x[1].split(" :", 1)
+            arguments = y[0].split()
+            if len(y) == 2:
+                arguments.append(y[1])
+    return (command, arguments)
+
+
+def old_dispatch(line: str) -> None:
+    """ConnectedClient.__command_handler() before COMMAND_HANDLERS."""
+    (command, arguments) = old_parse(line)
+    handler_table = {
+        "AWAY": noop_handler,
+        "GETCHANKEY": noop_handler,
+        "GETCKEY": noop_handler,
+        "ISON": noop_handler,
+        "JOIN": noop_handler,
+        "LIST": noop_handler,
+        "LUSERS": noop_handler,
+        "MODE": noop_handler,
+        "MOTD": noop_handler,
+        "NAMES": noop_handler,
+        "NOTICE": noop_handler,
+        "NICK": noop_handler,
+        "PART": noop_handler,
+        "PING": noop_handler,
+        "PONG": noop_handler,
+        "PRIVMSG": noop_handler,
+        "QUIT": noop_handler,
+        "SETCHANKEY": noop_handler,
+        "SETCKEY": noop_handler,
+        "TOPIC": noop_handler,
+        "UTM": noop_handler,
+        "WALLOPS": noop_handler,
+        "WHO": noop_handler,
+        "WHOIS": noop_handler,
+    }
+    try:
+        handler_table[command.upper()](command, arguments, None)
+    except KeyError:
+        pass
+
+
+def new_parse(line: str) -> Tuple[str, List[str]]:
+    """parse_line(), made comparable to old_parse()."""
+    message = parse_line(line)
+    return (message.command, message.arguments)
+
+
+def new_dispatch(line: str) -> None:
+    message = parse_line(line)
+    handler = HANDLERS.get(message.command)
+    if handler is not None:
+        handler(message.command, message.arguments, None)
+
+
+def measure(function: Callable[[str], object]) -> float:
+    """Nanoseconds per line, best of five."""
+    number = max(1, ROUNDS // len(LINES))
+    best = min(
+        repeat(lambda: [function(line) for line in LINES], number=number, repeat=5)
+    )
+    return best / (number * len(LINES)) * 1e9
+
+
+def main() -> None:
+    for line in LINES:
+        assert old_parse(line) == new_parse(line), line
+    print(f"{len(LINES)} lines, Python {sys.version.split()[0]}")
+    for name, function in (
+        ("old parse", old_parse),
+        ("new parse", parse_line),
+        ("old parse + dispatch", old_dispatch),
+        ("new parse + dispatch", new_dispatch),
+    ):
+        print(f"{name:>22}: {measure(function):7.0f} ns/line")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compares delivering UTMs the old way (a directed UTM scanning every member
+of every channel of the sender, rebuilding the member list at every step)
+against utm_handler(), for a full 20 player plaza and a 500 member channel.
+
+Run it from the top of the repository with `python benchmarks/utm.py`.
+"""
+from __future__ import annotations
+from itertools import cycle
+from typing import List
+
+from fan_out import old_add_to_write_buffer, old_channel_utm, old_writebuffers, UTM
+from harness import connect, drain, make_server, measure
+from source.commands.channel_or_session import utm_handler
+from source.connected_client import ConnectedClient
+from source.pkg4.user_message import UTMMessage
+
+# Name --> Members.
+CHANNELS = (("20 player plaza", 20), ("500 member channel", 500))
+
+
+def old_directed_utm(client: ConnectedClient, arguments: List[str]) -> None:
+    """utm_handler() for a nickname, before the nickname and neighbour maps."""
+    UTMMessage(arguments[1])
+    for j in range(0, len(client.channels)):
+        channel = client.channels[list(client.channels)[j]]
+        for i in range(0, len(list(channel.members))):
+            if list(channel.members)[i].nickname == arguments[0]:
+                old_add_to_write_buffer(
+                    list(channel.members)[i],
+                    f":{client.get_prefix()} UTM {arguments[0]} :{arguments[1]}",
+                )
+
+
+def main() -> None:
+    print("                      directed old/new (us)   #channel old/new (us)")
+    for name, members in CHANNELS:
+        server = make_server()
+        clients = [connect(server, f"Player{i}", "#plaza") for i in range(members)]
+        drain(server)
+        sender = clients[0]
+        # Every member in turn.
+        targets = cycle([client.nickname or "" for client in clients])
+        number = 20000 // members
+
+        def reset() -> None:
+            drain(server)
+            old_writebuffers.clear()
+
+        timings = [
+            measure(
+                lambda: old_directed_utm(sender, [next(targets), UTM]), number, reset
+            ),
+            measure(
+                lambda: utm_handler("UTM", [next(targets), UTM], sender), number, reset
+            ),
+            measure(lambda: old_channel_utm(sender, ["#plaza", UTM]), number, reset),
+            measure(lambda: utm_handler("UTM", ["#plaza", UTM], sender), number, reset),
+        ]
+        print(
+            f"{name:>20}  "
+            + "   ".join(
+                f"{old:9.1f} / {new:7.1f}"
+                for (old, new) in zip(timings[::2], timings[1::2])
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+from .connected_client import ConnectedClient
+from loguru import logger
+from time import time
+from typing import List, TYPE_CHECKING
+import asyncio
+import socket
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Avoid Circular imports.
+if TYPE_CHECKING:
+    from .server import Server
+
+
+class ClientProtocol(asyncio.Protocol):
+    """Glue between an asyncio transport, and the `ConnectedClient` that runs
+    the commands for it."""
+
+    def __init__(self, engine: AsyncioEngine):
+        self.engine: AsyncioEngine = engine
+        self.client: ConnectedClient | None = None
+        self.transport: asyncio.Transport | None = None
+        self.paused: bool = False
+        self.flush_scheduled: bool = False
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        server = self.engine.server
+        self.transport = transport  # type: ignore
+        sock = transport.get_extra_info("socket")
+        (host, port) = transport.get_extra_info("peername")[:2]
+        try:
+            client = ConnectedClient(server, sock)
+        except socket.error as cause:
+            logger.debug(f"socket error: {cause}")
+            transport.close()
+            return
+        self.client = client
+        server.metrics.increment("connections_accepted")
+        self.engine.protocols[client] = self
+        server.clients[sock] = client
+        logger.info(f"Accepted connection from {host}:{port}.")
+
+    def data_received(self, data: bytes) -> None:
+        if self.client is not None:
+            self.client.data_received(data)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        client = self.client
+        if client is not None and client.socket in client.server.clients:
+            client.disconnect(exc or "EOT")
+
+    def pause_writing(self) -> None:
+        self.paused = True
+
+    def resume_writing(self) -> None:
+        self.paused = False
+        self.flush()
+
+    def schedule_flush(self) -> None:
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.engine.loop.call_soon(self.flush)  # type: ignore
+
+    def flush(self) -> None:
+        self.flush_scheduled = False
+        if self.paused or self.client is None or self.transport is None:
+            return
+        if self.transport.is_closing():
+            return
+        chunks = self.client.take_write_queue()
+        if chunks:
+            self.transport.writelines(chunks)
+
+
+class AsyncioEngine(object):
+    """An event loop built on `asyncio` transports (or uvloop when it is
+    installed).
+
+    Runs the exact same `ConnectedClient` and command handlers as the
+    `SelectorEngine`, only the socket handling differs.
+    """
+
+    def __init__(self, server: Server):
+        self.server: Server = server
+        self.loop: asyncio.AbstractEventLoop | None = None
+        # ConnectedClient --> ClientProtocol
+        self.protocols: dict[ConnectedClient, ClientProtocol] = {}
+        self.__timer_handle: asyncio.TimerHandle | None = None
+
+    def register(self, client: ConnectedClient) -> None:
+        # The transport is already being watched by asyncio, the protocol
+        # links itself up once the client has been created.
+        pass
+
+    def set_writable(self, client: ConnectedClient, writable: bool) -> None:
+        protocol = self.protocols.get(client)
+        if writable and protocol is not None:
+            protocol.schedule_flush()
+
+    def close(self, client: ConnectedClient) -> None:
+        protocol = self.protocols.pop(client, None)
+        if protocol is not None and protocol.transport is not None:
+            protocol.flush()
+            protocol.transport.close()
+
+    def run(self, serversockets: List[socket.socket]) -> None:
+        if uvloop is not None:
+            logger.info("Using uvloop for the asyncio engine.")
+            loop = uvloop.new_event_loop()
+        else:
+            loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.loop = loop
+
+        for serversocket in serversockets:
+            loop.run_until_complete(
+                loop.create_server(
+                    lambda: ClientProtocol(self),
+                    sock=serversocket,
+                    # Also how many connections asyncio accepts per wakeup.
+                    backlog=self.server.listen_backlog,
+                    ssl=self.server.ssl_context,
+                )
+            )
+        scheduler = self.server.scheduler
+        scheduler.on_earliest_deadline = self.__arm_timers
+        deadline = scheduler.next_deadline()
+        if deadline is not None:
+            self.__arm_timers(deadline)
+        loop.run_forever()
+
+    def __arm_timers(self, deadline: float) -> None:
+        if self.__timer_handle is not None:
+            self.__timer_handle.cancel()
+        delay = max(0.0, deadline - time())
+        self.__timer_handle = self.loop.call_later(  # type: ignore
+            delay, self.__run_timers
+        )
+
+    def __run_timers(self) -> None:
+        self.__timer_handle = None
+        scheduler = self.server.scheduler
+        scheduler.run_due()
+        deadline = scheduler.next_deadline()
+        if deadline is not None and self.__timer_handle is None:
+            self.__arm_timers(deadline)
@@ -1,52 +1,228 @@
 from __future__ import annotations
+from .irc_helpers import encode_line, format_reply, IRCStatusCode
 from .pkg4.encoding import dwc_encode
 from .pkg4.generator import generate_random_lobby
-from typing import Tuple, TYPE_CHECKING
-import os
-import tempfile
+from .pkg4.time import LobbyStartTime
+from bisect import bisect_left, insort
+from typing import Callable, Dict, List, Tuple, TYPE_CHECKING
 
 # Avoid Circular imports.
 if TYPE_CHECKING:
     from .connected_client import ConnectedClient
+    from .scheduler import Timer
     from .server import Server
 
+# Channel key name --> Its value in a channel, if it has one.
+CHANNEL_KEYS: Dict[str, Callable[[Channel], str | None]] = {
+    "b_lib_c_lobby": lambda channel: channel.serialized_lobby,
+    "b_lib_c_time": lambda channel: dwc_encode(
+        LobbyStartTime(channel.started_at_time).to_serialized()
+    ),
+    "b_lby_wlddata": lambda channel: channel.serialized_world_data,
+}
+# Client key name --> MemberKeys slot holding its value.
+CLIENT_KEY_SLOTS = {"b_lib_u_user": "user", "b_lib_u_system": "system"}
+
+
+class MemberKeys(object):
+    """The client keys (SETCKEY) one member has set in a channel."""
+
+    __slots__ = ("user", "system")
+
+    def __init__(self):
+        self.user: str | None = None
+        self.system: str | None = None
+
+    def render(self, names: List[str]) -> str:
+        """The values of the given keys, as in a GETCKEY reply."""
+        values = []
+        for name in names:
+            slot = CLIENT_KEY_SLOTS.get(name)
+            value = getattr(self, slot) if slot is not None else None
+            values.append(value or "")
+        return "\\" + "\\".join(values)
+
+    def render_pairs(self) -> str:
+        """Every key that has been set, as `\\key\\value...` like SETCKEY."""
+        return "".join(
+            f"\\{name}\\{getattr(self, slot)}"
+            for name, slot in CLIENT_KEY_SLOTS.items()
+            if getattr(self, slot) is not None
+        )
+
 
 class Channel(object):
     def __init__(self, server: Server, name: str):
         self.name: str = name
         self.members: set[ConnectedClient] = set()
+        # The members connected to this worker (all of them, unless running
+        # with --workers).
+        self.local_members: set[ConnectedClient] = set()
         self.server: Server = server
+        # Whether this worker runs the channel, rather than only keeping track
+        # of its members and topic for the worker that does.
+        self.owned: bool = server.owns(name)
+        # The members nicknames, kept sorted as they join, leave, and rename.
+        self.__nicknames: List[str] = []
+        # Line length budget --> Encoded bodies of the 353 (NAMES) replies.
+        self.__names_cache: Dict[int, List[bytes]] = {}
+        # (Member, Key names) --> The latest BCAST line for those keys, not
+        # sent out yet.
+        self.__key_broadcasts: Dict[
+            Tuple[ConnectedClient | None, Tuple[str, ...]], str
+        ] = {}
+        self.__key_broadcast_timer: Timer | None = None
+        # `\\key` --> `\\key\\value`, as GETCHANKEY answers with.
+        self.__key_replies: Dict[str, str] = {}
+        # Encoded BCAST lines of every key, for --join-snapshot.
+        self.__join_snapshot: bytes | None = None
         self.__topic: str = ""
         self.__key: str | None = None
-        if self.server.state_dir:
-            state_file_path = name.replace("_", "__").replace("/", "_")
-            self.__state_path = f"{self.server.state_dir}/{state_file_path}"
-            self.__read_state()
-        else:
-            self.__state_path = None
-        if self.server.respect_web:
+        if self.server.respect_web or not self.owned:
             self.__serialized_lobby: str | None = None
         else:
             self.__serialized_lobby: str | None = dwc_encode(
                 generate_random_lobby().to_serialized()
             )
         self.__serialized_world_data: str | None = None
+        if self.owned and self.server.state_store is not None:
+            # Whatever was saved wins over the defaults above.
+            self.__read_state()
         # This can be dependent on the time from the DS in order to
         # properly forward time.
         #
         # This was the timestamp constant we used before.
         self.started_at_time = 560470305
-        self.client_keys: dict[Tuple[str, str], str] = {}
+        # Only members that have set any keys, dropped as they leave or
+        # change nicknames.
+        self.member_keys: Dict[ConnectedClient, MemberKeys] = {}
 
     def add_member(self, client):
+        if client in self.members:
+            return
+        neighbours = client.neighbours
+        # Clients only ever count other clients of the same worker as their
+        # neighbours, as every worker tells its own clients about a QUIT/NICK.
+        if client.socket is not None:
+            for member in self.members:
+                if member.socket is not None:
+                    neighbours[member] = neighbours.get(member, 0) + 1
+                member.neighbours[client] = member.neighbours.get(client, 0) + 1
+            self.local_members.add(client)
+        else:
+            for member in self.local_members:
+                neighbours[member] = neighbours.get(member, 0) + 1
         self.members.add(client)
+        if client.nickname:
+            insort(self.__nicknames, client.nickname)
+        self.__names_cache.clear()
+
+    def broadcast_keys(
+        self, client: ConnectedClient | None, keys: str, line: str
+    ) -> None:
+        """Queues up the BCAST `line` announcing new values for `keys` (of
+        the member `client`, or of the channel itself), replacing any not yet
+        sent for the same keys. Whatever is queued up goes out to every member
+        as a single batch, once per loop iteration (or key broadcast window).
+        Those of a member leaving or changing nicknames before then are
+        dropped, rather than going out after its PART/QUIT/NICK."""
+        pending = self.__key_broadcasts
+        slot = (client, tuple(keys.split("\\")[1::2]))
+        if pending.pop(slot, None) is not None:
+            self.server.metrics.increment("key_broadcasts_coalesced")
+        pending[slot] = line
+        if self.__key_broadcast_timer is None:
+            scheduler = self.server.scheduler
+            window = self.server.key_broadcast_window
+            if window > 0:
+                timer = scheduler.call_later(window, self.__send_key_broadcasts)
+            else:
+                timer = scheduler.call_soon(self.__send_key_broadcasts)
+            self.__key_broadcast_timer = timer
+
+    def flush_key_broadcasts(self) -> None:
+        """Sends whatever BCASTs broadcast_keys() has queued up right away, so
+        that a GETCKEY/GETCHANKEY reply can't overtake the BCAST of a
+        SETCKEY/SETCHANKEY that came before it."""
+        if self.__key_broadcast_timer is not None:
+            self.server.scheduler.cancel(self.__key_broadcast_timer)
+            self.__send_key_broadcasts()
+
+    def set_member_key(self, client: ConnectedClient, slot: str, value: str) -> None:
+        keys = self.member_keys.get(client)
+        if keys is None:
+            keys = self.member_keys[client] = MemberKeys()
+        setattr(keys, slot, value)
+        self.__join_snapshot = None
+
+    def get_join_snapshot(self) -> bytes:
+        """The channel keys, and the keys of every member that has set any,
+        as the BCAST lines SETCHANKEY and SETCKEY send out, so that someone
+        who just joined doesn't have to GETCHANKEY/GETCKEY them one by one."""
+        if self.__join_snapshot is not None:
+            return self.__join_snapshot
+        channel_keys = ""
+        for name, render in CHANNEL_KEYS.items():
+            value = render(self)
+            if value is not None:
+                channel_keys += f"\\{name}\\{value}"
+        lines = [
+            format_reply(
+                IRCStatusCode.SuccessfulChanKeyOp,
+                params=[self.name, self.name, "BCAST"],
+                trailing=channel_keys,
+            )
+        ]
+        for member, keys in self.member_keys.items():
+            lines.append(
+                format_reply(
+                    IRCStatusCode.SuccessfulClientKeyOp,
+                    params=[self.name, self.name, member.nickname, "BCAST"],
+                    trailing=keys.render_pairs(),
+                )
+            )
+        self.__join_snapshot = b"".join(encode_line(line) for line in lines)
+        return self.__join_snapshot
+
+    def get_names(self, max_length: int) -> List[bytes]:
+        """The sorted member nicknames, split up into the bodies of as many 353
+        replies as it takes to keep each one under `max_length` characters."""
+        bodies = self.__names_cache.get(max_length)
+        if bodies is not None:
+            return bodies
+        bodies = []
+        names: List[str] = []
+        length = 0
+        for name in self.__nicknames:
+            # Using >= to include the space in front of "name".
+            if names and length + len(name) >= max_length:
+                bodies.append(f"{' '.join(names)}\r\n".encode())
+                names = []
+            length = length + 1 + len(name) if names else len(name)
+            names.append(name)
+        if names:
+            bodies.append(f"{' '.join(names)}\r\n".encode())
+        self.__names_cache[max_length] = bodies
+        return bodies
+
+    def get_key_reply(self, key: str) -> str:
+        """The `\\key\\value` a GETCHANKEY for `key` gets back, rendered once
+        for every time the value changes."""
+        reply = self.__key_replies.get(key)
+        if reply is None:
+            render = CHANNEL_KEYS.get(key[1:]) if key[:1] == "\\" else None
+            reply = f"{key}\\{render(self) if render is not None else None}"
+            if render is not None:
+                # Unknown keys don't get to take up room.
+                self.__key_replies[key] = reply
+        return reply
 
     def get_key(self):
         return self.__key
 
     def set_key(self, value: str | None):
         self.__key = value
-        self.__write_state()
+        self.__state_changed()
 
     key = property(get_key, set_key)
 
@@ -55,7 +231,10 @@ class Channel(object):
 
     def set_topic(self, value: str):
         self.__topic = value
-        self.__write_state()
+        self.__state_changed()
+        if self.owned and self.server.bus is not None:
+            # For everyone else's LIST.
+            self.server.bus.topic_changed(self)
 
     topic = property(get_topic, set_topic)
 
@@ -64,7 +243,9 @@ class Channel(object):
 
     def set_serialized_lobby(self, value: str):
         self.__serialized_lobby = value
-        self.__write_state()
+        self.__key_replies.clear()
+        self.__join_snapshot = None
+        self.__state_changed()
 
     serialized_lobby = property(get_serialized_lobby, set_serialized_lobby)
 
@@ -73,38 +254,87 @@ class Channel(object):
 
     def set_serialized_world_data(self, value: str):
         self.__serialized_world_data = value
-        self.__write_state()
+        self.__key_replies.clear()
+        self.__join_snapshot = None
+        self.__state_changed()
 
     serialized_world_data = property(
         get_serialized_world_data, set_serialized_world_data
     )
 
+    def member_renamed(
+        self, client: ConnectedClient, old_nickname: str | None, new_nickname: str
+    ) -> None:
+        # Whatever keys were set belonged to the old nickname.
+        if self.member_keys.pop(client, None) is not None:
+            self.__join_snapshot = None
+        self.__drop_key_broadcasts(client)
+        if old_nickname:
+            self.__discard_nickname(old_nickname)
+        insort(self.__nicknames, new_nickname)
+        self.__names_cache.clear()
+
     def remove_client(self, client: ConnectedClient) -> None:
-        self.members.discard(client)
+        if client in self.members:
+            self.members.discard(client)
+            if self.member_keys.pop(client, None) is not None:
+                self.__join_snapshot = None
+            self.__drop_key_broadcasts(client)
+            neighbours = client.neighbours
+            if client.socket is not None:
+                self.local_members.discard(client)
+                for member in self.members:
+                    if member.socket is not None:
+                        self.__unshare(neighbours, member)
+                    self.__unshare(member.neighbours, client)
+            else:
+                for member in self.local_members:
+                    self.__unshare(neighbours, member)
+            if client.nickname:
+                self.__discard_nickname(client.nickname)
+            self.__names_cache.clear()
         if not self.members:
             self.server.remove_channel(self)
 
-    def __read_state(self):
-        if not (self.__state_path and os.path.exists(self.__state_path)):
+    def __send_key_broadcasts(self) -> None:
+        self.__key_broadcast_timer = None
+        (pending, self.__key_broadcasts) = (self.__key_broadcasts, {})
+        if not pending:
+            # All of them dropped along with the members they were about.
             return
-        data = {}
+        data = b"".join(encode_line(line) for line in pending.values())
+        for member in self.members:
+            member.add_encoded_to_write_buffer(data)
+
+    def __drop_key_broadcasts(self, client: ConnectedClient) -> None:
+        pending = self.__key_broadcasts
+        for slot in [slot for slot in pending if slot[0] is client]:
+            del pending[slot]
 
-        with open(self.__state_path, "rb") as state_file:
-            exec(state_file.read(), {}, data)
+    def __discard_nickname(self, nickname: str) -> None:
+        nicknames = self.__nicknames
+        index = bisect_left(nicknames, nickname)
+        if index < len(nicknames) and nicknames[index] == nickname:
+            del nicknames[index]
+
+    def __unshare(
+        self, neighbours: Dict[ConnectedClient, int], client: ConnectedClient
+    ) -> None:
+        count = neighbours[client] - 1
+        if count:
+            neighbours[client] = count
+        else:
+            del neighbours[client]
 
+    def __read_state(self):
+        data = self.server.state_store.load(self.name)  # type: ignore
+        if data is None:
+            return
         self.__topic = data.get("topic", "")
         self.__key = data.get("key")
         self.__serialized_lobby = data.get("serialized_lobby", None)
         self.__serialized_world_data = data.get("serialized_world_data", None)
 
-    def __write_state(self):
-        if not self.__state_path:
-            return
-        (fd, path) = tempfile.mkstemp(dir=os.path.dirname(self.__state_path))
-        fp = os.fdopen(fd, "w")
-        fp.write(f"topic = {self.__topic}\n")
-        fp.write(f"key = {self.__key}\n")
-        fp.write(f"serialized_lobby = {self.__serialized_lobby}\n")
-        fp.write(f"serialized_world_data = {self.__serialized_world_data}\n")
-        fp.close()
-        os.rename(path, self.__state_path)
+    def __state_changed(self):
+        if self.owned and self.server.state_store is not None:
+            self.server.state_store.mark_dirty(self)
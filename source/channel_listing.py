@@ -0,0 +1,111 @@
+from __future__ import annotations
+from .irc_helpers import IRCStatusCode, irc_lower
+from bisect import bisect_left, bisect_right
+from typing import List, Pattern, TYPE_CHECKING
+import re
+
+# Avoid Circular imports.
+if TYPE_CHECKING:
+    from .connected_client import ConnectedClient
+    from .scheduler import Timer
+
+# How many channels get looked at per loop iteration.
+LIST_BATCH = 500
+
+
+def compile_mask(mask: str) -> Pattern[str]:
+    """Turns an IRC mask (with `*` and `?` wildcards) into a pattern that
+    matches irc_lower'ed channel names."""
+    pattern = re.escape(irc_lower(mask)).replace(r"\*", ".*").replace(r"\?", ".")
+    return re.compile(f"{pattern}\\Z", re.DOTALL)
+
+
+class ChannelListing(object):
+    """Writes out the reply to a LIST a batch of channels at a time, one batch
+    per loop iteration, so that listing every channel doesn't hold up everyone
+    else.
+
+    Every batch picks up right after the last channel looked at, so channels
+    coming and going in between don't upset it. Understands the ELIST style
+    filters `LIST mask,mask,>N,<N`, where masks may use `*` and `?`, and `>N`
+    and `<N` only list channels with more or fewer than N members.
+    """
+
+    def __init__(self, client: ConnectedClient, conditions: List[str]):
+        self.client: ConnectedClient = client
+        self.masks: List[Pattern[str]] = []
+        self.min_members: int | None = None
+        self.max_members: int | None = None
+        # Only irc_lower'ed channel names from here on, up to `__end`.
+        self.__start = ""
+        self.__end: str | None = None
+        self.__cursor: str | None = None
+        self.__timer: Timer | None = None
+        masks: List[str] = []
+        for condition in conditions:
+            if condition[:1] in (">", "<") and condition[1:].isdigit():
+                if condition[0] == ">":
+                    self.min_members = int(condition[1:]) + 1
+                else:
+                    self.max_members = int(condition[1:]) - 1
+            elif condition:
+                masks.append(condition)
+        self.masks = [compile_mask(mask) for mask in masks]
+        if len(masks) == 1:
+            # Only channels starting with the part before the first wildcard
+            # can possibly match, which the sorted index can skip right to.
+            prefix = irc_lower(re.split(r"[*?]", masks[0], 1)[0])
+            if prefix:
+                self.__start = prefix
+                self.__end = prefix + "\U0010ffff"
+
+    def cancel(self) -> None:
+        self.client.server.scheduler.cancel(self.__timer)
+        self.__timer = None
+
+    def start(self) -> None:
+        self.__step()
+
+    def __step(self) -> None:
+        self.__timer = None
+        client = self.client
+        server = client.server
+        if client.socket not in server.clients:
+            # Gone, or a replica of a client connected to another worker.
+            return
+        if client.write_queue_size() > server.sendq_soft_limit:
+            # Let the client catch up first.
+            self.__timer = server.scheduler.call_later(0.1, self.__step)
+            return
+        index = server.channel_index
+        if self.__cursor is None:
+            position = bisect_left(index, self.__start)
+        else:
+            position = bisect_right(index, self.__cursor)
+        end = min(len(index), position + LIST_BATCH)
+        if self.__end is not None:
+            end = min(end, bisect_right(index, self.__end, position, end))
+        for key in index[position:end]:
+            self.__list(key)
+        if end < len(index) and (self.__end is None or index[end] <= self.__end):
+            self.__cursor = index[end - 1]
+            self.__timer = server.scheduler.call_soon(self.__step)
+            return
+        client.reply(
+            IRCStatusCode.ReplyListEnd, params=[client.nickname], trailing="End of LIST"
+        )
+
+    def __list(self, key: str) -> None:
+        if self.masks and not any(mask.match(key) for mask in self.masks):
+            return
+        channel = self.client.server.channels[key]
+        members = len(channel.members)
+        if self.min_members is not None and members < self.min_members:
+            return
+        if self.max_members is not None and members > self.max_members:
+            return
+        self.client.reply(
+            IRCStatusCode.ReplyListItem,
+            params=[self.client.nickname, channel.name, str(members)],
+            trailing=channel.topic,
+        )
@@ -0,0 +1,143 @@
+from __future__ import annotations
+from collections import OrderedDict
+from datetime import datetime, timezone
+from loguru import logger
+from queue import Empty, SimpleQueue
+from threading import Thread
+from time import time
+from typing import Dict, List, Tuple, TextIO
+import os
+
+# How many log files are kept open at once, the least recently written to get
+# closed first.
+MAX_OPEN_FILES = 64
+# Buffered records get written out once there are this many bytes of them, or
+# once the oldest one has waited this many seconds, whichever comes first.
+FLUSH_BYTES = 64 * 1024
+FLUSH_INTERVAL = 1.0
+
+# Put on the queue to have the writer thread finish up.
+_STOP: Tuple[str, str] = ("", "")
+
+
+class ChannelLogWriter(object):
+    """Writes channel logs from a background thread.
+
+    The event loop only formats the record and puts it on a queue. The writer
+    thread batches records up, keeps the files open, and rotates them once they
+    grow past `max_bytes` (keeping `backup_count` old ones around).
+    """
+
+    def __init__(self, directory: str, max_bytes: int, backup_count: int):
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.backup_count: int = backup_count
+        self.__queue: SimpleQueue[Tuple[str, str]] = SimpleQueue()
+        # Log file name --> Open file, in least recently used order.
+        self.__files: OrderedDict[str, TextIO] = OrderedDict()
+        # Log file name --> Size in bytes.
+        self.__sizes: Dict[str, int] = {}
+        self.__second = 0
+        self.__timestamp = ""
+        self.__thread = Thread(target=self.__run, name="channel-log", daemon=True)
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """Writes out everything still queued up, and closes the files."""
+        if self.__thread.is_alive():
+            self.__queue.put(_STOP)
+            self.__thread.join()
+
+    def timestamp(self) -> str:
+        # Only rendered once a second, however many lines get logged.
+        now = int(time())
+        if now != self.__second:
+            self.__second = now
+            self.__timestamp = datetime.fromtimestamp(now, timezone.utc).strftime(
+                "%Y-%m-%d %H:%M:%S UTC"
+            )
+        return self.__timestamp
+
+    def write(self, channel_name: str, record: str) -> None:
+        logname = channel_name.replace("_", "__").replace("/", "_")
+        self.__queue.put((logname, record))
+
+    def __close_all(self) -> None:
+        for fp in self.__files.values():
+            fp.close()
+        self.__files.clear()
+
+    def __flush(self, pending: Dict[str, List[str]]) -> None:
+        for logname, records in pending.items():
+            data = "".join(records)
+            try:
+                fp = self.__open(logname)
+                if (
+                    self.max_bytes
+                    and self.__sizes[logname] + len(data) > self.max_bytes
+                ):
+                    fp = self.__rotate(logname)
+                fp.write(data)
+                fp.flush()
+                self.__sizes[logname] += len(data)
+            except OSError as cause:
+                logger.error(f"Could not write channel log {logname}: {cause}")
+                fp = self.__files.pop(logname, None)
+                if fp is not None:
+                    fp.close()
+
+    def __open(self, logname: str) -> TextIO:
+        fp = self.__files.get(logname)
+        if fp is not None:
+            self.__files.move_to_end(logname)
+            return fp
+        if len(self.__files) >= MAX_OPEN_FILES:
+            (_, oldest) = self.__files.popitem(last=False)
+            oldest.close()
+        fp = open(f"{self.directory}/{logname}.log", "a")
+        self.__files[logname] = fp
+        self.__sizes[logname] = fp.tell()
+        return fp
+
+    def __rotate(self, logname: str) -> TextIO:
+        self.__files.pop(logname).close()
+        path = f"{self.directory}/{logname}.log"
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{path}.{index}"):
+                    os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+        return self.__open(logname)
+
+    def __run(self) -> None:
+        # Log file name --> Records waiting to be written.
+        pending: Dict[str, List[str]] = {}
+        pending_bytes = 0
+        deadline: float | None = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time())
+            try:
+                item = self.__queue.get(timeout=timeout)
+            except Empty:
+                # The oldest pending record has waited long enough.
+                item = None
+            if item is _STOP:
+                self.__flush(pending)
+                self.__close_all()
+                return
+            if item is not None:
+                (logname, record) = item
+                pending.setdefault(logname, []).append(record)
+                pending_bytes += len(record)
+                if deadline is None:
+                    deadline = time() + FLUSH_INTERVAL
+                if pending_bytes < FLUSH_BYTES:
+                    continue
+            self.__flush(pending)
+            pending = {}
+            pending_bytes = 0
+            deadline = None
@@ -1,12 +1,18 @@
-from ..irc_helpers import irc_lower, IRCStatusCode, VALID_CHANNELNAME_REGEXP
-from ..pkg4.encoding import dwc_decode, dwc_encode
+from ..channel import MemberKeys
+from ..channel_listing import ChannelListing
+from ..irc_helpers import (
+    encode_line,
+    format_reply,
+    irc_lower,
+    IRCStatusCode,
+    VALID_CHANNELNAME_REGEXP,
+)
+from ..pkg4.encoding import dwc_decode
 from ..pkg4.lobby import PkWifiLobby
-from ..pkg4.time import LobbyStartTime
 from ..pkg4.world_data import LobbyWorldData
 import binascii
-import struct
 from loguru import logger
-from typing import List, Union, TYPE_CHECKING
+from typing import List, TYPE_CHECKING
 
 # Avoid Circular Imports
 if TYPE_CHECKING:
@@ -18,8 +24,7 @@ def getchankey_handler(_: str, arguments: List[str], client: "ConnectedClient")
         client.reply_not_enough_parameters("GETCHANKEY")
         return
 
-    key = arguments[3]
-    channel = client.channels[irc_lower(arguments[0])]
+    channel = client.channels.get(irc_lower(arguments[0]))
     if not channel:
         client.reply(
             IRCStatusCode.UnknownTarget,
@@ -27,25 +32,21 @@ def getchankey_handler(_: str, arguments: List[str], client: "ConnectedClient")
             trailing="No such channel",
         )
         return
-    value = None
-    # if we bumped to python3.10 we'd get match!!! but people running old stuff
-    if key == "\\b_lby_wlddata":
-        value = channel.serialized_world_data
-    elif key == "\\b_lib_c_lobby":
-        value = channel.serialized_lobby
-    elif key == "\\b_lib_c_time":
-        value = dwc_encode(LobbyStartTime(channel.started_at_time).to_serialized())
+    channel.flush_key_broadcasts()
     client.reply(
         IRCStatusCode.SuccessfulChanKeyOp,
         params=[client.nickname, channel.name, arguments[1]],
-        trailing=f"{key}\\{value}",
+        trailing=channel.get_key_reply(arguments[3]),
     )
 
 
 def getclientkey_handler(
     _: str, arguments: List[str], client: "ConnectedClient"
 ) -> None:
-    channel = client.channels[irc_lower(arguments[0])]
+    if len(arguments) < 5:
+        client.reply_not_enough_parameters("GETCKEY")
+        return
+    channel = client.channels.get(irc_lower(arguments[0]))
     if not channel:
         client.reply(
             IRCStatusCode.UnknownTarget,
@@ -53,21 +54,35 @@ def getclientkey_handler(
             trailing="No such channel",
         )
         return
-    value = None
-    if arguments[4] == "\\b_lib_u_user":
-        value = channel.client_keys[(arguments[1], "user")]
-    elif arguments[4] == "\\b_lib_u_system":
-        value = channel.client_keys[(arguments[1], "system")]
-    client.reply(
-        IRCStatusCode.SuccessfulClientKeyOp,
-        params=[
-            client.nickname,
-            arguments[0],
-            arguments[1],
-            arguments[2],
-        ],
-        trailing=f"\\{value}",
-    )
+    channel.flush_key_broadcasts()
+    # `\\key\\key...`, answered with `\\value\\value...` for each target.
+    names = arguments[4].split("\\")[1:]
+    if arguments[1] == "*":
+        targets = [member for member in channel.members if member.nickname]
+    else:
+        target = client.server.get_client(arguments[1])
+        targets = [target] if target in channel.members else []
+    no_keys = MemberKeys()
+    lines = []
+    for target in targets:
+        keys = channel.member_keys.get(target, no_keys)
+        lines.append(
+            format_reply(
+                IRCStatusCode.SuccessfulClientKeyOp,
+                params=[client.nickname, arguments[0], target.nickname, arguments[2]],
+                trailing=keys.render(names),
+            )
+        )
+    if arguments[1] == "*" or not targets:
+        lines.append(
+            format_reply(
+                IRCStatusCode.EndOfClientKeys,
+                params=[client.nickname, arguments[0], arguments[2]],
+                trailing="End of GETCKEY",
+            )
+        )
+    # Answered all at once, rather than a line at a time.
+    client.add_encoded_to_write_buffer(b"".join(encode_line(line) for line in lines))
 
 
 def join_handler(_: str, arguments: List[str], client: "ConnectedClient") -> None:
@@ -75,27 +90,27 @@ def join_handler(_: str, arguments: List[str], client: "ConnectedClient") -> Non
         client.reply_not_enough_parameters("JOIN")
         return
     if arguments[0] == "0":
-        for channel_name, channel in client.channels.items():
+        bus = client.server.bus
+        for channel_name, channel in list(client.channels.items()):
+            if not channel.owned:
+                # Parted by the worker owning it.
+                continue
             client.message_channel(channel, "PART", channel_name, True)
             client.channel_log(channel, "left", meta=True)
+            del client.channels[channel_name]
             client.server.remove_member_from_channel(client, channel_name)
-        client.channels = {}
+            if bus is not None:
+                bus.parted(client, channel)
         return
     client.send_names(arguments, for_join=True)
 
 
-def list_handler(_: str, __: List[str], client: "ConnectedClient") -> None:
-    channels = client.server.channels.values()
-    sorted_channels = sorted(channels, key=lambda x: x.name)
-    for channel in sorted_channels:
-        client.reply(
-            IRCStatusCode.ReplyListItem,
-            params=[client.nickname, channel.name, str(len(channel.members))],
-            trailing=channel.topic,
-        )
-    client.reply(
-        IRCStatusCode.ReplyListEnd, params=[client.nickname], trailing="End of LIST"
-    )
+def list_handler(_: str, arguments: List[str], client: "ConnectedClient") -> None:
+    if client.listing is not None:
+        client.listing.cancel()
+    conditions = arguments[0].split(",") if arguments else []
+    client.listing = ChannelListing(client, conditions)
+    client.listing.start()
 
 
 def part_handler(_: str, arguments: List[str], client: "ConnectedClient") -> None:
@@ -125,10 +140,15 @@ def part_handler(_: str, arguments: List[str], client: "ConnectedClient") -> Non
             client.channel_log(channel, f"left ({partmsg})", meta=True)
             del client.channels[irc_lower(channelname)]
             client.server.remove_member_from_channel(client, channelname)
+            if client.server.bus is not None:
+                client.server.bus.parted(client, channel)
 
 
 def setchankey_handler(_: str, arguments: List[str], client: "ConnectedClient") -> None:
-    channel = client.channels[irc_lower(arguments[0])]
+    if len(arguments) < 2:
+        client.reply_not_enough_parameters("SETCHANKEY")
+        return
+    channel = client.channels.get(irc_lower(arguments[0]))
     if not channel:
         client.reply(
             IRCStatusCode.UnknownTarget,
@@ -150,8 +170,10 @@ def setchankey_handler(_: str, arguments: List[str], client: "ConnectedClient")
         try:
             decoded = dwc_decode(serialized)
             _deserialized = PkWifiLobby.from_serialized(decoded)
-        except Union[binascii.Error, struct.error]:
-            logger.error(f"Failed to decode \\b_lib_c_lobby data: {serialized}")
+        except Exception as cause:
+            logger.error(
+                f"Failed to decode \\b_lib_c_lobby data: {serialized} / {cause}"
+            )
         channel.serialized_lobby = serialized
     elif arguments[1][:13] == "\\b_lby_wlddata":
         serialized = arguments[1][13:]
@@ -161,21 +183,29 @@ def setchankey_handler(_: str, arguments: List[str], client: "ConnectedClient")
         try:
             decoded = dwc_decode(serialized)
             _deserialized = LobbyWorldData.from_serialized(decoded)
-        except Union[binascii.Error, struct.error]:
-            logger.error(f"Failed to decode \\b_lby_wlddata data: {serialized}")
+        except Exception as cause:
+            logger.error(
+                f"Failed to decode \\b_lby_wlddata data: {serialized} / {cause}"
+            )
         channel.serialized_world_data = serialized
-    for i in range(0, len(list(channel.members))):
-        list(channel.members)[i].reply(
+    channel.broadcast_keys(
+        None,
+        arguments[1],
+        format_reply(
             IRCStatusCode.SuccessfulChanKeyOp,
             params=[arguments[0], arguments[0], "BCAST"],
             trailing=arguments[1],
-        )
+        ),
+    )
 
 
 def setclientkey_handler(
     _: str, arguments: List[str], client: "ConnectedClient"
 ) -> None:
-    channel = client.channels[irc_lower(arguments[0])]
+    if len(arguments) < 3:
+        client.reply_not_enough_parameters("SETCKEY")
+        return
+    channel = client.channels.get(irc_lower(arguments[0]))
     if not channel:
         client.reply(
             IRCStatusCode.UnknownTarget,
@@ -195,7 +225,7 @@ def setclientkey_handler(
             _decoded = dwc_decode(value)
         except binascii.Error:
             logger.error(f"Failed to decode \\b_lib_u_user data: {value}")
-        channel.client_keys[(client.nickname or "", "user")] = value
+        channel.set_member_key(client, "user", value)
     elif arguments[2][:15] == "\\b_lib_u_system":
         value = arguments[2][16:]
         if len(value) > 24:
@@ -209,14 +239,16 @@ def setclientkey_handler(
             _decoded = dwc_decode(value)
         except binascii.Error:
             logger.error(f"Failed to decode \\b_lib_u_system data: {value}")
-        channel.client_keys[(client.nickname or "", "system")] = value
-    channel = client.channels[irc_lower(arguments[0])]
-    for i in range(0, len(list(channel.members))):
-        list(channel.members)[i].reply(
+        channel.set_member_key(client, "system", value)
+    channel.broadcast_keys(
+        client,
+        arguments[2],
+        format_reply(
             IRCStatusCode.SuccessfulClientKeyOp,
             params=[arguments[0], arguments[0], arguments[1], "BCAST"],
             trailing=arguments[2],
-        )
+        ),
+    )
 
 
 def topic_handler(_: str, arguments: List[str], client: "ConnectedClient") -> None:
@@ -1,4 +1,4 @@
-from ..irc_helpers import IRCStatusCode, irc_lower
+from ..irc_helpers import broadcast, encode_line, IRCStatusCode, irc_lower
 from ..pkg4.user_message import UTMMessage
 from loguru import logger
 from typing import List, TYPE_CHECKING
@@ -120,16 +120,28 @@ def utm_handler(_: str, arguments: List[str], client: "ConnectedClient") -> None
     except Exception as cause:
         logger.error(f"Failed to parse UTM message: {arguments[1]} / {cause}")
     if arguments[0][0] != "#":
-        for j in range(0, len(client.channels)):
-            channel = client.channels[list(client.channels)[j]]
-            for i in range(0, len(list(channel.members))):
-                if list(channel.members)[i].nickname == arguments[0]:
-                    list(channel.members)[i].raw_add_to_write_buffer(
-                        f":{client.get_prefix()} UTM {arguments[0]} :{arguments[1]}"
-                    )
-    if arguments[0][0] == "#":
-        channel = client.channels[irc_lower(arguments[0])]
-        for i in range(0, len(list(channel.members))):
-            list(channel.members)[i].raw_add_to_write_buffer(
-                f":{client.get_prefix()} UTM {arguments[0]} :{arguments[1]}"
+        # Only delivered to someone sharing a channel with the sender.
+        target = client.server.get_client(arguments[0])
+        if target is None or target.nickname != arguments[0]:
+            return
+        if client.shares_channel_with(target) or (target is client and client.channels):
+            target.add_encoded_to_write_buffer(
+                encode_line(
+                    f":{client.get_prefix()} UTM {arguments[0]} :{arguments[1]}"
+                ),
+                low_priority=True,
             )
+        return
+    channel = client.channels.get(irc_lower(arguments[0]))
+    if not channel:
+        client.reply(
+            IRCStatusCode.UnknownTarget,
+            params=[client.nickname, arguments[0]],
+            trailing="No such channel",
+        )
+        return
+    broadcast(
+        channel.members,
+        f":{client.get_prefix()} UTM {arguments[0]} :{arguments[1]}",
+        low_priority=True,
+    )
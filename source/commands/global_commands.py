@@ -1,4 +1,4 @@
-from ..irc_helpers import IRCStatusCode
+from ..irc_helpers import broadcast, IRCStatusCode
 from loguru import logger
 from typing import List, TYPE_CHECKING
 
@@ -41,10 +41,10 @@ def wallops_handler(_: str, arguments: List[str], client: "ConnectedClient") ->
         client.reply_not_enough_parameters("WALLOPS")
         return
     message = arguments[0]
-    for other_client in client.server.clients.values():
-        other_client.raw_add_to_write_buffer(
-            f":{client.get_prefix()} NOTICE {client.nickname} :Global notice: {message}"
-        )
+    broadcast(
+        client.server.clients.values(),
+        f":{client.get_prefix()} NOTICE {client.nickname} :Global notice: {message}",
+    )
 
 
 def who_handler(_: str, arguments: List[str], client: "ConnectedClient"):
@@ -0,0 +1,70 @@
+from ..irc_helpers import IRCStatusCode, VALID_NICKNAME_REGEXP
+from typing import Callable, Dict, List, TYPE_CHECKING
+
+# Avoid Circular Imports
+if TYPE_CHECKING:
+    from ..connected_client import ConnectedClient
+
+
+def pass_handler(_: str, arguments: List[str], client: "ConnectedClient") -> None:
+    if len(arguments) == 0:
+        client.reply_not_enough_parameters("PASS")
+    elif arguments[0].lower() == client.server.password:
+        client.password_accepted()
+    else:
+        client.reply(IRCStatusCode.PasswordIncorrect, trailing="Password incorrect")
+
+
+def registration_nick_handler(
+    _: str, arguments: List[str], client: "ConnectedClient"
+) -> None:
+    if len(arguments) < 1:
+        client.reply(IRCStatusCode.NoNicknameGiven, trailing="No nickname given")
+        return
+    nick = arguments[0]
+    if client.server.get_client(nick):
+        client.reply(
+            IRCStatusCode.NicknameInUse,
+            params=["*", nick],
+            trailing="Nickname is already in use",
+        )
+    elif not VALID_NICKNAME_REGEXP.match(nick):
+        client.reply(
+            IRCStatusCode.NicknameInvalid,
+            params=["*", nick],
+            trailing="Erroneous nickname",
+        )
+    else:
+        client.nickname = nick
+        client.server.client_changed_nickname(client, None, client.nickname)
+    client.finish_registration()
+
+
+def registration_quit_handler(_: str, __: List[str], client: "ConnectedClient") -> None:
+    client.disconnect("Client quit")
+
+
+def registration_user_handler(
+    _: str, arguments: List[str], client: "ConnectedClient"
+) -> None:
+    if len(arguments) < 4:
+        client.reply_not_enough_parameters("USER")
+        return
+    client.user = arguments[0]
+    client.realname = arguments[3]
+    client.finish_registration()
+
+
+# Command --> Handler, for clients that still have to send the server password.
+PASS_HANDLERS: Dict[str, Callable[[str, List[str], "ConnectedClient"], None]] = {
+    "PASS": pass_handler,
+    "QUIT": registration_quit_handler,
+}
+# Command --> Handler, for clients that haven't sent both NICK and USER yet.
+REGISTRATION_HANDLERS: Dict[
+    str, Callable[[str, List[str], "ConnectedClient"], None]
+] = {
+    "NICK": registration_nick_handler,
+    "QUIT": registration_quit_handler,
+    "USER": registration_user_handler,
+}
@@ -24,97 +24,270 @@ from .commands.global_commands import (
     who_handler,
     whois_handler,
 )
+from .commands.registration import PASS_HANDLERS, REGISTRATION_HANDLERS
 from .commands.session import (
     away_handler,
     ison_handler,
     nick_handler,
     quit_handler,
 )
+from .flood_control import COMMAND_CLASSES, FloodControl, MAX_PENDING_LINES
 from .irc_helpers import (
+    broadcast,
+    encode_line,
+    format_reply,
     IRCStatusCode,
     irc_lower,
-    LINESEP_REGEXP,
     VALID_CHANNELNAME_REGEXP,
-    VALID_NICKNAME_REGEXP,
 )
+from .line_framer import LineFramer, LineTooLongError
+from .message import Message, parse_line
+from .scheduler import Timer
 from .version import VERSION
-from datetime import datetime
+from collections import deque
+from itertools import chain, islice
 from loguru import logger
 from socket import socket
 from time import time
-from typing import Callable, List, TYPE_CHECKING
+from typing import Callable, Deque, Dict, Iterable, List, Tuple, TYPE_CHECKING
+import ssl
 
 # Avoid Circular imports.
 if TYPE_CHECKING:
     from .channel import Channel
+    from .channel_listing import ChannelListing
     from .server import Server
 
+# How many queued lines get handed to a single `sendmsg` call, well under the
+# usual IOV_MAX of 1024.
+SENDMSG_MAX_CHUNKS = 256
+# What a non-blocking (possibly TLS) socket raises when it isn't ready yet.
+WOULD_BLOCK_ERRORS = (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError)
+# Command --> Handler, for registered clients.
+COMMAND_HANDLERS: Dict[str, Callable[[str, List[str], "ConnectedClient"], None]] = {
+    "AWAY": away_handler,
+    "GETCHANKEY": getchankey_handler,
+    "GETCKEY": getclientkey_handler,
+    "ISON": ison_handler,
+    "JOIN": join_handler,
+    "LIST": list_handler,
+    "LUSERS": lusers_handler,
+    "MODE": mode_handler,
+    "MOTD": motd_handler,
+    "NAMES": names_handler,
+    "NOTICE": notice_and_privmsg_handler,
+    "NICK": nick_handler,
+    "PART": part_handler,
+    "PING": ping_handler,
+    "PONG": pong_handler,
+    "PRIVMSG": notice_and_privmsg_handler,
+    "QUIT": quit_handler,
+    "SETCHANKEY": setchankey_handler,
+    "SETCKEY": setclientkey_handler,
+    "TOPIC": topic_handler,
+    "UTM": utm_handler,
+    "WALLOPS": wallops_handler,
+    "WHO": who_handler,
+    "WHOIS": whois_handler,
+}
+
 
 class ConnectedClient(object):
-    def __init__(self, server: Server, socket: socket):
+    def __init__(
+        self,
+        server: Server,
+        socket: socket | None,
+        address: Tuple[str, int] | None = None,
+    ):
         self.server: Server = server
         self.socket = socket
+        # Only set when running with multiple workers.
+        self.client_id: str | None = None
         # irc_lower(Channel name) --> Channel
         self.channels: dict[str, "Channel"] = {}
+        # Every other client sharing a channel with this one --> How many
+        # channels they share, kept up to date by Channel as members come and
+        # go, so that QUIT and NICK don't have to gather them up each time.
+        self.neighbours: Dict[ConnectedClient, int] = {}
         self.nickname: str | None = None
         self.user: str | None = None
         self.realname: str | None = None
-        if self.server.ipv6:
-            (self.host, self.port, _, _) = socket.getpeername()
+        # The LIST reply still being written out, if any.
+        self.listing: ChannelListing | None = None
+        if address is not None:
+            (self.host, self.port) = address
+        elif self.server.ipv6:
+            (self.host, self.port, _, _) = socket.getpeername()  # type: ignore
         else:
-            (self.host, self.port) = socket.getpeername()
+            (self.host, self.port) = socket.getpeername()  # type: ignore
         self.__timestamp = time()
-        self.__readbuffer = ""
-        self.__writebuffer = ""
+        self.__framer = LineFramer()
+        self.__tls = isinstance(socket, ssl.SSLSocket)
+        # Lines that have been received, but not run yet, either because this
+        # iterations line budget ran out or because the client is throttled.
+        self.__pending_lines: Deque[str] = deque()
+        self.__pending_timer: Timer | None = None
+        self.__flood_control = FloodControl()
+        # Whether this client is one of the sampled connections in the wire
+        # trace, and whether its traffic gets logged (or traced) at all. Checked
+        # before formatting anything, so the hot path costs nothing otherwise.
+        self.__trace_sampled = (
+            socket is not None and server.wire_trace.sample_connection()
+        )
+        self.__traced = False
+        self.__wire_logged = False
+        self.update_wire_trace()
+        # Encoded lines waiting to be sent, the first one of which has already
+        # been partially sent up to `__writeoffset`.
+        self.__writequeue: Deque[bytes] = deque()
+        self.__writequeue_size = 0
+        self.__writeoffset = 0
+        self.__sendq_exceeded = False
         self.__sent_ping = False
+        self.__aliveness_timer: Timer | None = None
+        # Command --> Handler, for whichever state the client is in.
         if self.server.password:
-            self.__handle_command = self.__pass_handler
+            self.__handlers = PASS_HANDLERS
         else:
-            self.__handle_command = self.__registration_handler
+            self.__handlers = REGISTRATION_HANDLERS
+        if socket is not None:
+            self.server.engine.register(self)
+            self.__aliveness_timer = self.server.scheduler.call_at(
+                self.__timestamp + 90, self.check_aliveness
+            )
 
     def channel_log(self, channel: "Channel", message: str, meta=False) -> None:
-        if not self.server.channel_log_dir:
+        writer = self.server.channel_log_writer
+        if writer is None or not channel.owned:
+            # Logged by the worker owning the channel.
             return
         if meta:
-            format = "[%s] * %s %s\n"
+            record = f"[{writer.timestamp()}] * {self.nickname} {message}\n"
         else:
-            format = "[%s] <%s> %s\n"
-        timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
-        logname = channel.name.replace("_", "__").replace("/", "_")
-        fp = open(f"{self.server.channel_log_dir}/{logname}.log", "a")
-        fp.write(format % (timestamp, self.nickname, message))
-        fp.close()
+            record = f"[{writer.timestamp()}] <{self.nickname}> {message}\n"
+        writer.write(channel.name, record)
 
     def check_aliveness(self) -> None:
+        # Reading from the socket only refreshes the timestamp, so when the
+        # timer fires it reschedules itself off of the latest activity.
         now = time()
-        if self.__timestamp + 180 < now:
+        if self.__timestamp + 180 <= now:
             self.disconnect("ping timeout")
             return
-        if not self.__sent_ping and self.__timestamp + 90 < now:
-            if self.__handle_command == self.__command_handler:
+        if not self.__sent_ping and self.__timestamp + 90 <= now:
+            if self.__handlers is COMMAND_HANDLERS:
                 # Registered.
                 self.raw_add_to_write_buffer(f"PING :{self.server.name}")
                 self.__sent_ping = True
             else:
                 # Not registered.
                 self.disconnect("ping timeout")
+                return
+        if self.__sent_ping:
+            deadline = self.__timestamp + 180
+        else:
+            deadline = self.__timestamp + 90
+        self.__aliveness_timer = self.server.scheduler.call_at(
+            deadline, self.check_aliveness
+        )
 
     def disconnect(self, quitmsg) -> None:
+        if self.socket not in self.server.clients:
+            # Already disconnected, e.g. twice by lines read at once.
+            return
         self.raw_add_to_write_buffer(f"ERROR :{quitmsg}")
         logger.info(
             f"Disconnected connection from {self.host}:{self.port} ({quitmsg})."
         )
-        self.socket.close()
+        self.server.engine.close(self)
+        self.server.scheduler.cancel(self.__aliveness_timer)
+        self.server.scheduler.cancel(self.__pending_timer)
+        self.__pending_lines.clear()
+        if self.listing is not None:
+            self.listing.cancel()
+        bus = self.server.bus
+        if bus is not None and not bus.replicating:
+            # Every worker removes the client once the quit has come back from
+            # the bus, to keep the order of events the same everywhere.
+            del self.server.clients[self.socket]
+            bus.publish(self, "quit", str(quitmsg))
+            return
         self.server.remove_client(self, quitmsg)
 
     def get_prefix(self) -> str:
         return f"{self.nickname}!{self.user}@{self.host}"
 
+    def finish_registration(self) -> None:
+        """Welcomes the client once it has sent both NICK and USER."""
+        if not (self.nickname and self.user):
+            return
+        server = self.server
+        self.reply(
+            IRCStatusCode.ReplyWelcome,
+            params=[self.nickname],
+            trailing="Hi, welcome to IRC",
+        )
+        self.reply(
+            IRCStatusCode.ReplySendHost,
+            params=[self.nickname],
+            trailing=f"Your host is {server.name}, running version "
+            + f"miniircd-{VERSION}",
+        )
+        self.reply(
+            IRCStatusCode.ReplyServerCreatedAt,
+            params=[self.nickname],
+            trailing="This server was created sometime",
+        )
+        self.reply(
+            IRCStatusCode.ReplyMyInfo,
+            params=[self.nickname, server.name, f"miniircd-{VERSION}", "o", "o"],
+        )
+        self.send_lusers()
+        self.send_motd()
+        self.__handlers = COMMAND_HANDLERS
+
+    def shares_channel_with(self, other: ConnectedClient) -> bool:
+        if other in self.neighbours:
+            return True
+        if other.socket is not None:
+            # Clients of the same worker would've been among the neighbours.
+            return False
+        return any(other in channel.members for channel in self.channels.values())
+
+    def handle_line(self, line: str) -> None:
+        self.handle_message(parse_line(line))
+
+    def handle_message(self, message: Message) -> None:
+        command = message.command
+        handler = self.__handlers.get(command)
+        if handler is not None:
+            try:
+                handler(command, message.arguments, self)
+            except Exception:
+                # Same answer as for an unknown command, rather than taking
+                # the whole server down over one client's line.
+                logger.exception(f"Failed to handle {command} from {self.nickname}")
+                self.reply(
+                    IRCStatusCode.UnknownCommand,
+                    params=[self.nickname, command],
+                    trailing="Unknown command",
+                )
+        elif self.__handlers is COMMAND_HANDLERS:
+            logger.debug(f"421 {self.nickname} {command} :Unknown command")
+            self.reply(
+                IRCStatusCode.UnknownCommand,
+                params=[self.nickname, command],
+                trailing="Unknown command",
+            )
+
+    def password_accepted(self) -> None:
+        self.__handlers = REGISTRATION_HANDLERS
+
     def send_lusers(self) -> None:
         self.reply(
             IRCStatusCode.ReplyLUsers,
             params=[self.nickname],
-            trailing=f"There are {len(self.server.clients)} "
+            trailing=f"There are {self.server.client_count()} "
             + "user and 0 services on 1 server",
         )
 
@@ -122,18 +295,13 @@ class ConnectedClient(object):
         self, channel: "Channel", command: str, message: str, include_self=False
     ) -> None:
         line = ":%s %s %s" % (self.get_prefix(), command, message)
-        for client in channel.members:
-            if client != self or include_self:
-                client.raw_add_to_write_buffer(line)
+        broadcast(channel.members, line, exclude=None if include_self else self)
 
     def message_related(self, msg: str, include_self=False) -> None:
-        clients = set()
-        for channel in self.channels.values():
-            clients |= channel.members
-        if not include_self:
-            clients.discard(self)
-        for client in clients:
-            client.raw_add_to_write_buffer(f":{self.get_prefix()} {msg}")
+        clients: Iterable[ConnectedClient] = self.neighbours
+        if include_self and self.channels:
+            clients = chain(clients, (self,))
+        broadcast(clients, f":{self.get_prefix()} {msg}")
 
     def reply(
         self,
@@ -141,16 +309,7 @@ class ConnectedClient(object):
         params: List[str | None] = [],
         trailing: str | None = "",
     ) -> None:
-        status_code = str(status.value).zfill(3)
-        message = f":s {status_code}"
-        for parameter in params:
-            if parameter is not None:
-                message += f" {parameter.rstrip()}"
-            else:
-                message += " *"
-        if trailing is not None and len(trailing) > 0:
-            message += f" :{trailing.rstrip()}"
-        self.raw_add_to_write_buffer(message)
+        self.raw_add_to_write_buffer(format_reply(status, params, trailing))
 
     def reply_not_enough_parameters(self, command: str) -> None:
         nickname = self.nickname or "*"
@@ -161,31 +320,9 @@ class ConnectedClient(object):
         )
 
     def send_motd(self) -> None:
-        server = self.server
-        motdlines = server.get_motd_lines()
-        if motdlines:
-            self.reply(
-                IRCStatusCode.MOTDStart,
-                params=[self.nickname],
-                trailing=f"- {server.name} Message of the day-",
-            )
-            for line in motdlines:
-                self.reply(
-                    IRCStatusCode.MOTDPart,
-                    params=[self.nickname],
-                    trailing=f"- {line.rstrip()}",
-                )
-            self.reply(
-                IRCStatusCode.MOTDEnd,
-                params=[self.nickname],
-                trailing="End of /MOTD command",
-            )
-        else:
-            self.reply(
-                IRCStatusCode.NoMOTD,
-                params=[self.nickname],
-                trailing="MOTD File is missing",
-            )
+        self.add_encoded_to_write_buffer(
+            self.server.motd.render(self.nickname)  # type: ignore
+        )
 
     def send_names(self, arguments: List[str], for_join=False) -> None:
         server = self.server
@@ -216,6 +353,8 @@ class ConnectedClient(object):
             if for_join:
                 channel.add_member(self)
                 self.channels[irc_lower(channel_name)] = channel
+                if server.bus is not None:
+                    server.bus.joined(self, channel)
                 self.message_channel(channel, "JOIN", channel_name, True)
                 self.channel_log(channel, "joined", meta=True)
                 if channel.topic:
@@ -231,191 +370,189 @@ class ConnectedClient(object):
                         trailing="No topic is set",
                     )
             names_prefix = "353 %s = %s :" % (self.nickname, channel_name)
-            names = ""
             # Max length: reply prefix ":server_name(space)" plus CRLF in
             # the end.
             names_max_len = 512 - (len(server.name) + 2 + 2)
-            for name in sorted(x.nickname or "" for x in channel.members):
-                if name == "":
-                    continue
-                if not names:
-                    names = names_prefix + name
-                # Using >= to include the space between "names" and "name".
-                elif len(names) + len(name) >= names_max_len:
-                    self.raw_add_to_write_buffer(names)
-                    names = names_prefix + name
-                else:
-                    names += " " + name
-            if names:
-                self.raw_add_to_write_buffer(names)
+            encoded_prefix = names_prefix.encode()
+            for body in channel.get_names(names_max_len - len(names_prefix)):
+                self.add_encoded_to_write_buffer(encoded_prefix + body)
             self.reply(
                 IRCStatusCode.ReplyEndOfNames,
                 params=[self.nickname, channel_name],
                 trailing="End of NAMES list",
             )
+            if for_join and server.join_snapshot:
+                self.add_encoded_to_write_buffer(channel.get_join_snapshot())
 
     def socket_readable_notification(self) -> None:
+        while True:
+            try:
+                lines = self.__framer.recv_from(self.socket)  # type: ignore
+                quitmsg = "EOT"
+            except WOULD_BLOCK_ERRORS:
+                return
+            except LineTooLongError:
+                self.disconnect("Input line too long")
+                return
+            except OSError as cause:
+                lines = None
+                quitmsg = cause
+            if lines is None:
+                self.disconnect(quitmsg)
+                return
+            self.__lines_received(lines)
+            # TLS may have already pulled more records off of the socket than
+            # we've read, which the selector can't tell us about.
+            if not self.__tls or self.socket not in self.server.clients:
+                return
+            if not self.socket.pending():  # type: ignore
+                return
+
+    def data_received(self, data: bytes) -> None:
         try:
-            data = self.socket.recv(2**10)
-            logger.debug(f"[{self.host}:{self.port}] -> {data}")
-            quitmsg = "EOT"
-        except OSError as cause:
-            data = ""
-            quitmsg = cause
-        if data:
-            self.__readbuffer += self.__socket_to_buffer(data)
-            self.__parse_read_buffer()
-            self.__timestamp = time()
-            self.__sent_ping = False
-        else:
-            self.disconnect(quitmsg)
+            lines = self.__framer.feed(data, len(data))
+        except LineTooLongError:
+            self.disconnect("Input line too long")
+            return
+        self.__lines_received(lines)
 
     def socket_writable_notification(self) -> None:
+        queue = self.__writequeue
+        chunks = list(islice(queue, 0, SENDMSG_MAX_CHUNKS))
+        if self.__writeoffset:
+            chunks[0] = memoryview(chunks[0])[self.__writeoffset :]
         try:
-            sent = self.socket.send(self.__buffer_to_socket(self.__writebuffer))
-            logger.debug(f"[{self.host}:{self.port}] <- {self.__writebuffer[:sent]}")
-            self.__writebuffer = self.__writebuffer[sent:]
+            if self.__tls:
+                # SSL sockets can't scatter/gather.
+                sent = self.socket.send(b"".join(chunks))  # type: ignore
+            else:
+                sent = self.socket.sendmsg(chunks)  # type: ignore
+        except WOULD_BLOCK_ERRORS:
+            return
         except OSError as cause:
             self.disconnect(cause)
+            return
+        if self.__wire_logged:
+            self.__log_wire("<-", b"".join(chunks)[:sent])
+        self.__writequeue_size -= sent
+        sent += self.__writeoffset
+        while queue and sent >= len(queue[0]):
+            sent -= len(queue.popleft())
+        self.__writeoffset = sent
+        if not queue:
+            self.server.engine.set_writable(self, False)
+
+    def take_write_queue(self) -> List[bytes]:
+        chunks = list(self.__writequeue)
+        if self.__writeoffset:
+            chunks[0] = chunks[0][self.__writeoffset :]
+        if self.__wire_logged:
+            self.__log_wire("<-", b"".join(chunks))
+        self.__writequeue.clear()
+        self.__writequeue_size = 0
+        self.__writeoffset = 0
+        return chunks
+
+    def update_wire_trace(self) -> None:
+        """Picks up a nickname change, which may start or stop the trace."""
+        wire_trace = self.server.wire_trace
+        self.__traced = self.__trace_sampled or (
+            self.socket is not None and wire_trace.wants_nickname(self.nickname)
+        )
+        self.__wire_logged = self.server.debug or self.__traced
 
     def write_queue_size(self) -> int:
-        return len(self.__writebuffer)
-
-    def raw_add_to_write_buffer(self, msg: str) -> None:
-        self.__writebuffer += msg.replace("\r\n", "").replace("\n", "") + "\r\n"
-
-    def __buffer_to_socket(self, msg: str) -> bytes:
-        return msg.encode()
-
-    def __command_handler(self, command: str, arguments: List[str]) -> None:
-        handler_table: dict[str, Callable[[str, List[str], ConnectedClient], None]] = {
-            "AWAY": away_handler,
-            "GETCHANKEY": getchankey_handler,
-            "GETCKEY": getclientkey_handler,
-            "ISON": ison_handler,
-            "JOIN": join_handler,
-            "LIST": list_handler,
-            "LUSERS": lusers_handler,
-            "MODE": mode_handler,
-            "MOTD": motd_handler,
-            "NAMES": names_handler,
-            "NOTICE": notice_and_privmsg_handler,
-            "NICK": nick_handler,
-            "PART": part_handler,
-            "PING": ping_handler,
-            "PONG": pong_handler,
-            "PRIVMSG": notice_and_privmsg_handler,
-            "QUIT": quit_handler,
-            "SETCHANKEY": setchankey_handler,
-            "SETCKEY": setclientkey_handler,
-            "TOPIC": topic_handler,
-            "UTM": utm_handler,
-            "WALLOPS": wallops_handler,
-            "WHO": who_handler,
-            "WHOIS": whois_handler,
-        }
-        try:
-            handler_table[command.upper()](command, arguments, self)
-        except KeyError:
-            logger.debug(f"421 {self.nickname} {command} :Unknown command")
-            self.reply(
-                IRCStatusCode.UnknownCommand,
-                params=[self.nickname, command],
-                trailing="Unknown command",
-            )
+        return self.__writequeue_size
 
-    def __parse_read_buffer(self) -> None:
-        lines = LINESEP_REGEXP.split(self.__readbuffer)
-        self.__readbuffer = lines[-1]
-        lines = lines[:-1]
-        for line in lines:
-            if not line:
-                # Empty line. Ignore.
-                continue
-            x = line.split(" ", 1)
-            command = x[0].upper()
-            if len(x) == 1:
-                arguments = []
-            else:
-                if len(x[1]) > 0 and x[1][0] == ":":
-                    arguments = [x[1][1:]]
-                else:
-                    y = x[1].split(" :", 1)
-                    arguments = y[0].split()
-                    if len(y) == 2:
-                        arguments.append(y[1])
-            self.__handle_command(command, arguments)
+    def raw_add_to_write_buffer(self, msg: str, low_priority=False) -> None:
+        self.add_encoded_to_write_buffer(encode_line(msg), low_priority)
 
-    def __pass_handler(self, command: str, arguments: List[str]) -> None:
+    def add_encoded_to_write_buffer(self, data: bytes, low_priority=False) -> None:
+        """Queues an already encoded line, which may be shared with any number
+        of other clients."""
         server = self.server
-        if command == "PASS":
-            if len(arguments) == 0:
-                self.reply_not_enough_parameters("PASS")
-            else:
-                if arguments[0].lower() == server.password:
-                    self.__handle_command = self.__registration_handler
-                else:
-                    self.reply(
-                        IRCStatusCode.PasswordIncorrect, trailing="Password incorrect"
-                    )
-        elif command == "QUIT":
-            self.disconnect("Client quit")
+        if self.__sendq_exceeded:
+            return
+        if low_priority and self.__writequeue_size >= server.sendq_soft_limit:
+            server.metrics.increment("sendq_soft_limit_drops")
+            return
+        if self.__writequeue_size + len(data) > server.sendq_hard_limit:
+            # We're likely in the middle of going through a channels members,
+            # so the actual disconnect has to wait.
+            server.metrics.increment("sendq_hard_limit_disconnects")
+            self.__sendq_exceeded = True
+            self.__writequeue.clear()
+            self.__writequeue_size = 0
+            self.__writeoffset = 0
+            server.scheduler.call_soon(self.__disconnect_sendq_exceeded)
+            return
+        if not self.__writequeue:
+            server.engine.set_writable(self, True)
+        self.__writequeue.append(data)
+        self.__writequeue_size += len(data)
+
+    def __disconnect_sendq_exceeded(self) -> None:
+        # May have already gone away on its own.
+        if self.socket in self.server.clients:
+            self.disconnect("SendQ exceeded")
+
+    def __lines_received(self, lines: List[str]) -> None:
+        self.__timestamp = time()
+        self.__sent_ping = False
+        pending = self.__pending_lines
+        pending.extend(lines)
+        if len(pending) > MAX_PENDING_LINES:
+            self.server.metrics.increment("excess_flood_disconnects")
+            self.disconnect("Excess flood")
+            return
+        if self.__pending_timer is None:
+            self.__run_pending_lines()
 
-    def __registration_handler(self, command: str, arguments: List[str]) -> None:
+    def __run_pending_lines(self) -> None:
+        """Runs as many of the pending lines as the line budget and the token
+        buckets allow, and schedules itself to run the rest later on."""
+        self.__pending_timer = None
         server = self.server
-        if command == "NICK":
-            if len(arguments) < 1:
-                self.reply(IRCStatusCode.NoNicknameGiven, trailing="No nickname given")
-                return
-            nick = arguments[0]
-            if server.get_client(nick):
-                self.reply(
-                    IRCStatusCode.NicknameInUse,
-                    params=["*", nick],
-                    trailing="Nickname is already in use",
-                )
-            elif not VALID_NICKNAME_REGEXP.match(nick):
-                self.reply(
-                    IRCStatusCode.NicknameInvalid,
-                    params=["*", nick],
-                    trailing="Erroneous nickname",
+        bus = server.bus
+        pending = self.__pending_lines
+        now = time()
+        budget = server.line_budget
+        while pending:
+            if budget == 0:
+                # Give everyone else a go first.
+                server.metrics.increment("lines_deferred")
+                self.__pending_timer = server.scheduler.call_soon(
+                    self.__run_pending_lines
                 )
-            else:
-                self.nickname = nick
-                server.client_changed_nickname(self, None, self.nickname)
-        elif command == "USER":
-            if len(arguments) < 4:
-                self.reply_not_enough_parameters("USER")
                 return
-            self.user = arguments[0]
-            self.realname = arguments[3]
-        elif command == "QUIT":
-            self.disconnect("Client quit")
-            return
-        if self.nickname and self.user:
-            self.reply(
-                IRCStatusCode.ReplyWelcome,
-                params=[self.nickname],
-                trailing="Hi, welcome to IRC",
-            )
-            self.reply(
-                IRCStatusCode.ReplySendHost,
-                params=[self.nickname],
-                trailing=f"Your host is {server.name}, running version "
-                + f"miniircd-{VERSION}",
-            )
-            self.reply(
-                IRCStatusCode.ReplyServerCreatedAt,
-                params=[self.nickname],
-                trailing="This server was created sometime",
-            )
-            self.reply(
-                IRCStatusCode.ReplyMyInfo,
-                params=[self.nickname, server.name, f"miniircd-{VERSION}", "o", "o"],
-            )
-            self.send_lusers()
-            self.send_motd()
-            self.__handle_command = self.__command_handler
+            line = pending[0]
+            message = parse_line(line)
+            kind = COMMAND_CLASSES.get(message.command)
+            if kind is not None:
+                delay = self.__flood_control.delay(kind, now)
+                if delay:
+                    server.metrics.increment(f"lines_throttled_{kind}")
+                    self.__pending_timer = server.scheduler.call_later(
+                        delay, self.__run_pending_lines
+                    )
+                    return
+            pending.popleft()
+            budget -= 1
+            if self.__wire_logged:
+                self.__log_wire("->", line)
+            if bus is not None:
+                bus.route(self, message, line)
+            else:
+                self.handle_message(message)
+                if self.socket not in server.clients:
+                    # Quit, or got kicked off by the line it just sent.
+                    return
+
+    def __log_wire(self, direction: str, data) -> None:
+        if self.server.debug:
+            logger.debug(f"[{self.host}:{self.port}] {direction} {data}")
+        if self.__traced:
+            self.server.wire_trace.record(self, direction, data)
 
     def __reply_unknown_channel(self, channel: str) -> None:
         self.reply(
@@ -423,6 +560,3 @@ class ConnectedClient(object):
             params=[self.nickname, channel],
             trailing="No such channel",
         )
-
-    def __socket_to_buffer(self, buf: bytes) -> str:
-        return buf.decode(errors="ignore")
@@ -0,0 +1,60 @@
+from __future__ import annotations
+from typing import Dict, Tuple
+
+# Command class --> (Tokens refilled per second, Burst size)
+BUCKET_LIMITS: Dict[str, Tuple[float, float]] = {
+    "utm": (10.0, 30.0),
+    "keys": (10.0, 30.0),
+    "queries": (2.0, 10.0),
+}
+# Command --> Command class, anything not in here is only subject to the line
+# budget.
+COMMAND_CLASSES: Dict[str, str] = {
+    "UTM": "utm",
+    "GETCHANKEY": "keys",
+    "GETCKEY": "keys",
+    "SETCHANKEY": "keys",
+    "SETCKEY": "keys",
+    "LIST": "queries",
+    "NAMES": "queries",
+    "WHO": "queries",
+    "WHOIS": "queries",
+}
+# Clients with more lines than this waiting to be run get disconnected.
+MAX_PENDING_LINES = 512
+
+
+class TokenBucket(object):
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate: float = rate
+        self.burst: float = burst
+        self.tokens: float = burst
+        self.updated: float = now
+
+    def delay(self, now: float) -> float:
+        """Takes a token, returning 0, or returns how many seconds to wait until
+        there is one to take."""
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return 0.0
+        self.tokens = tokens
+        return (1 - tokens) / self.rate
+
+
+class FloodControl(object):
+    """A clients token buckets, one per command class, created as needed."""
+
+    def __init__(self):
+        # Command class --> TokenBucket
+        self.__buckets: Dict[str, TokenBucket] = {}
+
+    def delay(self, command_class: str, now: float) -> float:
+        bucket = self.__buckets.get(command_class)
+        if bucket is None:
+            (rate, burst) = BUCKET_LIMITS[command_class]
+            bucket = self.__buckets[command_class] = TokenBucket(rate, burst, now)
+        return bucket.delay(now)
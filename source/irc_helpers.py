@@ -1,7 +1,13 @@
+from __future__ import annotations
 from enum import Enum
+from typing import Iterable, List, TYPE_CHECKING
 import re2
 import string
 
+# Avoid Circular imports.
+if TYPE_CHECKING:
+    from .connected_client import ConnectedClient
+
 
 class IRCStatusCode(Enum):
     """Think HTTP Status Codes, but for IRC commands.
@@ -11,6 +17,7 @@ class IRCStatusCode(Enum):
     interprets them as.
     """
 
+    EndOfClientKeys = 703
     IncorrectKey = 475
     MOTDStart = 375
     MOTDPart = 372
@@ -55,12 +62,53 @@ class IRCStatusCode(Enum):
 __ircstring_translation = str.maketrans(
     string.ascii_lowercase.upper() + "[]\\^", string.ascii_lowercase + "{}|~"
 )
+__ircbytes_translation = bytes.maketrans(
+    (string.ascii_lowercase.upper() + "[]\\^").encode(),
+    (string.ascii_lowercase + "{}|~").encode(),
+)
 
 
 def irc_lower(to_lower: str):
+    if to_lower.isascii():
+        # Same mapping, but a byte table is several times quicker than a dict.
+        return to_lower.encode().translate(__ircbytes_translation).decode()
     return to_lower.translate(__ircstring_translation)
 
 
 LINESEP_REGEXP = re2.compile(r"\r?\n")
 VALID_NICKNAME_REGEXP = re2.compile(r"^[][\`_^{|}A-Za-z][][\`_^{|}A-Za-z0-9-]{0,50}$")
 VALID_CHANNELNAME_REGEXP = re2.compile(r"^[&#+!][^\x00\x07\x0a\x0d ,:]{0,50}$")
+
+
+def encode_line(line: str) -> bytes:
+    """Sanitizes a line, and encodes it exactly how it goes over the wire."""
+    if "\n" in line:
+        line = line.replace("\r\n", "").replace("\n", "")
+    return (line + "\r\n").encode()
+
+
+def format_reply(
+    status: IRCStatusCode, params: List[str | None] = [], trailing: str | None = ""
+) -> str:
+    message = f":s {str(status.value).zfill(3)}"
+    for parameter in params:
+        if parameter is not None:
+            message += f" {parameter.rstrip()}"
+        else:
+            message += " *"
+    if trailing is not None and len(trailing) > 0:
+        message += f" :{trailing.rstrip()}"
+    return message
+
+
+def broadcast(
+    clients: Iterable[ConnectedClient],
+    line: str,
+    exclude: ConnectedClient | None = None,
+    low_priority=False,
+) -> None:
+    """Encodes `line` once, and queues that same object up for every client."""
+    data = encode_line(line)
+    for client in clients:
+        if client is not exclude:
+            client.add_encoded_to_write_buffer(data, low_priority)
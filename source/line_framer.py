@@ -0,0 +1,68 @@
+from __future__ import annotations
+from typing import List, Union
+import socket
+
+# Peerchat lines are tiny (the largest being a ~400 byte SETCHANKEY), so
+# anything past this is garbage, or someone trying to eat our memory.
+MAX_LINE_LENGTH = 1024
+RECV_BUFFER_SIZE = 2**16
+
+# Every client reads into this same buffer, only a trailing partial line ever
+# gets copied out into a clients own framer.
+_recv_buffer = bytearray(RECV_BUFFER_SIZE)
+
+
+class LineTooLongError(Exception):
+    pass
+
+
+class LineFramer(object):
+    """Splits the bytes coming from a client into lines.
+
+    Only newly received bytes are ever scanned for a newline, and the partial
+    line left over between reads is the only thing kept around per client.
+    """
+
+    def __init__(self, max_line_length: int = MAX_LINE_LENGTH):
+        self.max_line_length: int = max_line_length
+        self.__partial = bytearray()
+
+    def recv_from(self, sock: socket.socket) -> List[str] | None:
+        """Reads whatever is available from `sock`, returning None on EOF."""
+        length = sock.recv_into(_recv_buffer)
+        if not length:
+            return None
+        return self.feed(_recv_buffer, length)
+
+    def feed(self, buffer: Union[bytes, bytearray], length: int) -> List[str]:
+        lines: List[str] = []
+        partial = self.__partial
+        start = 0
+        with memoryview(buffer) as view:
+            while start < length:
+                newline = buffer.find(b"\n", start, length)
+                if newline < 0:
+                    partial += view[start:length]
+                    if len(partial) > self.max_line_length:
+                        raise LineTooLongError()
+                    break
+                if partial:
+                    partial += view[start:newline]
+                    end = len(partial)
+                    if end and partial[end - 1] == 13:
+                        end -= 1
+                    if end > self.max_line_length:
+                        raise LineTooLongError()
+                    if end:
+                        lines.append(partial[:end].decode(errors="ignore"))
+                    partial.clear()
+                else:
+                    end = newline
+                    if end > start and buffer[end - 1] == 13:
+                        end -= 1
+                    if end - start > self.max_line_length:
+                        raise LineTooLongError()
+                    if end > start:
+                        lines.append(str(view[start:end], "utf-8", "ignore"))
+                start = newline + 1
+        return lines
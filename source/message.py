@@ -0,0 +1,25 @@
+from __future__ import annotations
+from typing import List
+
+
+class Message(object):
+    """A parsed line, e.g. `PRIVMSG #room :hello there` has the command
+    `PRIVMSG` and the arguments `["#room", "hello there"]`, the trailing one
+    (if any) last, the way the command handlers take them."""
+
+    __slots__ = ("command", "arguments")
+
+    def __init__(self, command: str, arguments: List[str]):
+        self.command = command
+        self.arguments = arguments
+
+
+def parse_line(line: str) -> Message:
+    (command, _, rest) = line.partition(" ")
+    if rest[:1] == ":":
+        return Message(command.upper(), [rest[1:]])
+    (middle, separator, trailing) = rest.partition(" :")
+    arguments = middle.split()
+    if separator:
+        arguments.append(trailing)
+    return Message(command.upper(), arguments)
@@ -0,0 +1,34 @@
+from __future__ import annotations
+from typing import Dict
+
+
+class Metrics(object):
+    """Plain counters for things worth keeping an eye on in production.
+
+    The server logs a summary every `--metrics-interval` seconds.
+    """
+
+    def __init__(self):
+        # Counter name --> Count
+        self.counters: Dict[str, int] = {}
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{name}={count}" for (name, count) in sorted(self.counters.items())
+        )
+
+
+def read_listen_overflows() -> int | None:
+    """How many times the kernel had to turn away a connection because some
+    accept queue was full, host wide (only available on Linux)."""
+    try:
+        with open("/proc/net/netstat", "r") as fp:
+            rows = [line.split() for line in fp if line.startswith("TcpExt:")]
+    except OSError:
+        return None
+    if len(rows) < 2 or "ListenOverflows" not in rows[0]:
+        return None
+    return int(rows[1][rows[0].index("ListenOverflows")])
@@ -3,25 +3,85 @@
 from .server import Server
 from .version import VERSION
 from loguru import logger
-from optparse import OptionParser
+from optparse import OptionParser, Values
+from typing import List
 import os
 import re
+import socket
 import sys
 
 
-def start():
+def parse_options(argv: List[str]) -> Values:
+    """Parses and checks the command line arguments `argv` (without the
+    program name), exiting with a usage message if they don't make sense."""
     op = OptionParser(
         version=VERSION, description="miniircd is a small and limited IRC server."
     )
     op.add_option(
         "--channel-log-dir", metavar="X", help="store channel log in directory X"
     )
+    op.add_option(
+        "--channel-log-max-size",
+        metavar="X",
+        default=10,
+        type="int",
+        help="rotate channel logs once they reach X MiB (keeping --log-count old"
+        " ones), 0 to never rotate; default: %default MiB",
+    )
     op.add_option(
         "-d", "--daemon", action="store_true", help="fork and become a daemon"
     )
+    op.add_option(
+        "--engine",
+        metavar="X",
+        default="selectors",
+        type="choice",
+        choices=["selectors", "asyncio"],
+        help="event loop to serve clients with, either selectors or asyncio"
+        " (uses uvloop when installed); default: %default",
+    )
+    op.add_option(
+        "--accept-batch",
+        metavar="X",
+        default=64,
+        type="int",
+        help="accept up to X pending connections per wakeup (selectors engine);"
+        " default: %default",
+    )
     op.add_option("--ipv6", action="store_true", help="use IPv6")
+    op.add_option(
+        "--join-snapshot",
+        action="store_true",
+        help="send every channel and client key to clients as they join a"
+        " channel, rather than having them ask for each one",
+    )
+    op.add_option(
+        "--key-broadcast-window",
+        metavar="X",
+        default=0.0,
+        type="float",
+        help="send out SETCKEY/SETCHANKEY updates in batches every X seconds,"
+        " keeping only the latest value of each key, 0 to batch up those of a"
+        " single loop iteration; default: %default",
+    )
     op.add_option("--debug", action="store_true", help="print debug messages to stdout")
+    op.add_option(
+        "--line-budget",
+        metavar="X",
+        default=16,
+        type="int",
+        help="run at most X lines per client before serving everyone else;"
+        " default: %default",
+    )
     op.add_option("--listen", metavar="X", help="listen on specific IP address X")
+    op.add_option(
+        "--listen-backlog",
+        metavar="X",
+        default=1024,
+        type="int",
+        help="queue up to X connections waiting to be accepted per port (capped"
+        " by the kernel, e.g. net.core.somaxconn); default: %default",
+    )
     op.add_option(
         "--respect-web",
         action="store_true",
@@ -40,7 +100,15 @@ def start():
         metavar="X",
         default=10,
         type="int",
-        help="set maximum log file size to X MiB; default: %default MiB",
+        help="set maximum log file size to X MiB (ignored with --workers, which"
+        " leaves rotating the log file to e.g. logrotate); default: %default MiB",
+    )
+    op.add_option(
+        "--metrics-interval",
+        metavar="X",
+        default=60,
+        type="int",
+        help="log metric counters every X seconds, 0 to disable; default: %default",
     )
     op.add_option("--motd", metavar="X", help="display file X as message of the day")
     op.add_option("--pid-file", metavar="X", help="write PID to file X")
@@ -61,6 +129,22 @@ def start():
         help="listen to ports X (a list separated by comma or whitespace);"
         " default: 6667 or 6697 if SSL is enabled",
     )
+    op.add_option(
+        "--sendq-hard-limit",
+        metavar="X",
+        default=1024,
+        type="int",
+        help="disconnect clients with more than X KiB waiting to be sent;"
+        " default: %default KiB",
+    )
+    op.add_option(
+        "--sendq-soft-limit",
+        metavar="X",
+        default=256,
+        type="int",
+        help="drop low priority traffic (UTM relays) for clients with more than"
+        " X KiB waiting to be sent; default: %default KiB",
+    )
     op.add_option(
         "-s",
         "--ssl-pem-file",
@@ -70,14 +154,48 @@ def start():
     op.add_option(
         "--state-dir",
         metavar="X",
-        help="save persistent channel state (topic, key) in directory X",
+        help="save persistent channel state (topic, key) in a database in"
+        " directory X",
+    )
+    op.add_option(
+        "--state-flush-interval",
+        metavar="X",
+        default=5,
+        type="float",
+        help="save changed channel state every X seconds; default: %default",
     )
     op.add_option(
         "--verbose",
         action="store_true",
         help="be verbose (print some progress messages to stdout)",
     )
+    op.add_option(
+        "--wire-trace-file",
+        metavar="X",
+        help="record everything sent and received by traced clients to file X",
+    )
+    op.add_option(
+        "--wire-trace-nicknames",
+        metavar="X",
+        help="trace clients using any of the nicknames X (a list separated by"
+        " comma or whitespace)",
+    )
+    op.add_option(
+        "--wire-trace-sample",
+        metavar="X",
+        default=0,
+        type="int",
+        help="trace 1 in every X connections, 0 to disable; default: %default",
+    )
     if os.name == "posix":
+        op.add_option(
+            "--workers",
+            metavar="X",
+            default=1,
+            type="int",
+            help="fork X worker processes that share the listening ports"
+            " (requires SO_REUSEPORT, and the selectors engine); default: %default",
+        )
         op.add_option(
             "--chroot",
             metavar="X",
@@ -91,7 +209,7 @@ def start():
             " (requires root)",
         )
 
-    (options, _args) = op.parse_args(sys.argv[1:])
+    (options, _args) = op.parse_args(argv)
     if options.debug:
         options.verbose = True
     if options.ports is None:
@@ -99,6 +217,33 @@ def start():
             options.ports = "6667"
         else:
             options.ports = "6697"
+    if options.accept_batch < 1:
+        op.error("--accept-batch must be at least 1")
+    if options.channel_log_max_size < 0:
+        op.error("--channel-log-max-size can't be negative")
+    if options.state_flush_interval <= 0:
+        op.error("--state-flush-interval must be positive")
+    if options.key_broadcast_window < 0:
+        op.error("--key-broadcast-window can't be negative")
+    if options.line_budget < 1:
+        op.error("--line-budget must be at least 1")
+    if options.listen_backlog < 1:
+        op.error("--listen-backlog must be at least 1")
+    if options.sendq_soft_limit > options.sendq_hard_limit:
+        op.error("--sendq-soft-limit can't be larger than --sendq-hard-limit")
+    if options.wire_trace_sample < 0:
+        op.error("--wire-trace-sample can't be negative")
+    if options.wire_trace_file is None and (
+        options.wire_trace_sample or options.wire_trace_nicknames
+    ):
+        op.error("--wire-trace-sample/--wire-trace-nicknames need --wire-trace-file")
+    if options.workers < 1:
+        op.error("Must run at least one worker")
+    if options.workers > 1:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            op.error("--workers requires SO_REUSEPORT support")
+        if options.engine != "selectors":
+            op.error("--workers is only supported with the selectors engine")
     if options.chroot:
         if os.getuid() != 0:
             op.error("Must be root to use --chroot")
@@ -133,7 +278,11 @@ def start():
         except ValueError:
             op.error("bad port: %r" % port)
     options.ports = ports
+    return options
+
 
+def start():
+    options = parse_options(sys.argv[1:])
     server = Server(options)
     if options.daemon:
         server.daemonize()
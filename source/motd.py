@@ -0,0 +1,88 @@
+from __future__ import annotations
+from .irc_helpers import encode_line, format_reply, IRCStatusCode
+from time import time
+from typing import List, TYPE_CHECKING
+import os
+
+# Avoid Circular imports.
+if TYPE_CHECKING:
+    from .server import Server
+
+# Stands in for the nickname while rendering, and can't appear anywhere else.
+_NICKNAME = "\x00"
+
+
+class MOTDCache(object):
+    """The whole MOTD reply block (375, 372..., 376 or 422), rendered and
+    encoded once, and split around the nickname so that each client only costs
+    a single `bytes.join`.
+
+    Rebuilt when the MOTD file's mtime changes (checked at most once a second),
+    or after `invalidate`, e.g. on SIGHUP.
+    """
+
+    def __init__(self, server: Server):
+        self.server: Server = server
+        self.__parts: List[bytes] | None = None
+        self.__mtime: float | None = None
+        self.__checked_at = 0.0
+
+    def invalidate(self) -> None:
+        self.__parts = None
+
+    def render(self, nickname: str) -> bytes:
+        now = time()
+        if self.__parts is not None and now - self.__checked_at >= 1:
+            self.__checked_at = now
+            if self.__current_mtime() != self.__mtime:
+                self.__parts = None
+        if self.__parts is None:
+            self.__checked_at = now
+            self.__mtime = self.__current_mtime()
+            self.__parts = self.__build()
+        return nickname.encode().join(self.__parts)
+
+    def __build(self) -> List[bytes]:
+        server = self.server
+        motdlines = server.get_motd_lines()
+        if not motdlines:
+            block = encode_line(
+                format_reply(
+                    IRCStatusCode.NoMOTD,
+                    params=[_NICKNAME],
+                    trailing="MOTD File is missing",
+                )
+            )
+            return block.split(_NICKNAME.encode())
+        lines = [
+            format_reply(
+                IRCStatusCode.MOTDStart,
+                params=[_NICKNAME],
+                trailing=f"- {server.name} Message of the day-",
+            )
+        ]
+        for line in motdlines:
+            lines.append(
+                format_reply(
+                    IRCStatusCode.MOTDPart,
+                    params=[_NICKNAME],
+                    trailing=f"- {line.rstrip().replace(_NICKNAME, '')}",
+                )
+            )
+        lines.append(
+            format_reply(
+                IRCStatusCode.MOTDEnd,
+                params=[_NICKNAME],
+                trailing="End of /MOTD command",
+            )
+        )
+        block = b"".join(encode_line(line) for line in lines)
+        return block.split(_NICKNAME.encode())
+
+    def __current_mtime(self) -> float | None:
+        if not self.server.motdfile:
+            return None
+        try:
+            return os.stat(self.server.motdfile).st_mtime
+        except OSError:
+            return None
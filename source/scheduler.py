@@ -0,0 +1,80 @@
+from __future__ import annotations
+from heapq import heapify, heappop, heappush
+from itertools import count
+from time import time
+from typing import Callable, List, Tuple
+
+
+class Timer(object):
+    __slots__ = ("when", "callback", "cancelled")
+
+    def __init__(self, when: float, callback: Callable[[], None]):
+        self.when: float = when
+        self.callback: Callable[[], None] = callback
+        self.cancelled: bool = False
+
+
+class Scheduler(object):
+    """A heap of timers for delayed work (aliveness checks, and the like).
+
+    The running engine asks how long it may sleep for, and runs whatever is
+    due after every wakeup. Cancelled timers are dropped lazily as they reach
+    the top of the heap, or all at once if they start to pile up.
+    """
+
+    def __init__(self):
+        self.__heap: List[Tuple[float, int, Timer]] = []
+        self.__sequence = count()
+        self.__cancelled = 0
+        # Called with the deadline whenever a timer becomes the earliest one,
+        # for engines that have to arm their own wakeup.
+        self.on_earliest_deadline: Callable[[float], None] | None = None
+
+    def call_at(self, when: float, callback: Callable[[], None]) -> Timer:
+        timer = Timer(when, callback)
+        heappush(self.__heap, (when, next(self.__sequence), timer))
+        if self.on_earliest_deadline is not None and self.__heap[0][2] is timer:
+            self.on_earliest_deadline(when)
+        return timer
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> Timer:
+        return self.call_at(time() + delay, callback)
+
+    def call_soon(self, callback: Callable[[], None]) -> Timer:
+        return self.call_at(time(), callback)
+
+    def cancel(self, timer: Timer | None) -> None:
+        if timer is None or timer.cancelled:
+            return
+        timer.cancelled = True
+        self.__cancelled += 1
+        if self.__cancelled > 64 and self.__cancelled > len(self.__heap) // 2:
+            self.__heap = [entry for entry in self.__heap if not entry[2].cancelled]
+            heapify(self.__heap)
+            self.__cancelled = 0
+
+    def next_deadline(self) -> float | None:
+        heap = self.__heap
+        while heap and heap[0][2].cancelled:
+            heappop(heap)
+            self.__cancelled -= 1
+        if heap:
+            return heap[0][0]
+        return None
+
+    def time_until_next(self) -> float | None:
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time())
+
+    def run_due(self) -> None:
+        heap = self.__heap
+        now = time()
+        while heap and heap[0][0] <= now:
+            (_, _, timer) = heappop(heap)
+            if timer.cancelled:
+                self.__cancelled -= 1
+                continue
+            timer.cancelled = True
+            timer.callback()
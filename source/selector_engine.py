@@ -0,0 +1,182 @@
+from __future__ import annotations
+from .connected_client import ConnectedClient
+from loguru import logger
+from functools import partial
+from typing import Callable, List, Tuple, TYPE_CHECKING
+import selectors
+import socket
+import ssl
+
+# Avoid Circular imports.
+if TYPE_CHECKING:
+    from .server import Server
+
+# Anyone who can't finish a TLS handshake in this many seconds gets dropped.
+TLS_HANDSHAKE_TIMEOUT = 10
+
+
+class SelectorEngine(object):
+    """An event loop built on top of `selectors` (epoll/kqueue where available).
+
+    Every socket is registered exactly once, and a clients write interest is
+    only touched when its write queue goes from empty to non-empty (or back),
+    so each wakeup only costs as much as the number of ready sockets.
+    """
+
+    def __init__(self, server: Server):
+        self.server: Server = server
+        self.selector = selectors.DefaultSelector()
+
+    def register(self, client: ConnectedClient) -> None:
+        self.selector.register(client.socket, selectors.EVENT_READ, client)
+
+    def set_writable(self, client: ConnectedClient, writable: bool) -> None:
+        events = selectors.EVENT_READ
+        if writable:
+            events |= selectors.EVENT_WRITE
+        try:
+            self.selector.modify(client.socket, events, client)
+        except (KeyError, ValueError):
+            # The client has already been closed, and unregistered.
+            pass
+
+    def add_handler(self, fileobj, callback: Callable[[bool, bool], None]) -> None:
+        """Watch something other than a client, `callback` gets called with
+        whether the file is readable, and whether it is writable."""
+        self.selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def set_handler_writable(
+        self, fileobj, callback: Callable[[bool, bool], None], writable: bool
+    ) -> None:
+        events = selectors.EVENT_READ
+        if writable:
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(fileobj, events, callback)
+
+    def close(self, client: ConnectedClient) -> None:
+        try:
+            self.selector.unregister(client.socket)
+        except (KeyError, ValueError):
+            pass
+        client.socket.close()
+
+    def run(self, serversockets: List[socket.socket]) -> None:
+        for serversocket in serversockets:
+            self.add_handler(serversocket, partial(self.__accept, serversocket))
+        clients = self.server.clients
+        scheduler = self.server.scheduler
+        while True:
+            for key, mask in self.selector.select(scheduler.time_until_next()):
+                client = key.data
+                if not isinstance(client, ConnectedClient):
+                    client(
+                        bool(mask & selectors.EVENT_READ),
+                        bool(mask & selectors.EVENT_WRITE),
+                    )
+                    continue
+                # A client may have been disconnected by someone else earlier
+                # in this same batch of events.
+                if mask & selectors.EVENT_READ and key.fileobj in clients:
+                    client.socket_readable_notification()
+                if mask & selectors.EVENT_WRITE and key.fileobj in clients:
+                    client.socket_writable_notification()
+            scheduler.run_due()
+
+    def add_client(self, conn: socket.socket, addr: Tuple[str, int]) -> None:
+        server = self.server
+        try:
+            client = ConnectedClient(server, conn)
+            server.clients[conn] = client
+            if server.bus is not None:
+                server.bus.attach(client)
+            logger.info(f"Accepted connection from {addr[0]}:{addr[1]}.")
+        except socket.error as cause:
+            logger.debug(f"socket error: {cause}")
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def __accept(self, serversocket: socket.socket, _: bool, __: bool) -> None:
+        # Drain a whole burst of connections per wakeup (e.g. everyone
+        # reconnecting after a restart), instead of one per trip around the loop.
+        metrics = self.server.metrics
+        for _ in range(self.server.accept_batch):
+            try:
+                (conn, addr) = serversocket.accept()
+            except BlockingIOError:
+                return
+            except OSError as cause:
+                # Most likely out of file descriptors, leave the rest queued.
+                logger.error(f"Could not accept a connection: {cause}")
+                metrics.increment("accept_errors")
+                return
+            metrics.increment("connections_accepted")
+            self.__setup_connection(conn, addr)
+        # There may well be more waiting, they'll be picked up next time around.
+        metrics.increment("accept_batches_full")
+
+    def __setup_connection(self, conn: socket.socket, addr: Tuple[str, int]) -> None:
+        server = self.server
+        conn.setblocking(False)
+        if server.ssl_context is not None:
+            try:
+                conn = server.ssl_context.wrap_socket(
+                    conn, server_side=True, do_handshake_on_connect=False
+                )
+            except OSError:
+                logger.exception(f"SSL connection error for {addr[0]}:{addr[1]}")
+                conn.close()
+                return
+            TLSHandshake(self, conn, addr).advance(True, False)  # type: ignore
+            return
+        self.add_client(conn, addr)
+
+
+class TLSHandshake(object):
+    """Drives a TLS handshake on a non-blocking socket, retrying whenever the
+    socket becomes ready, instead of blocking the whole loop on it."""
+
+    def __init__(
+        self, engine: SelectorEngine, conn: ssl.SSLSocket, addr: Tuple[str, int]
+    ):
+        self.engine: SelectorEngine = engine
+        self.conn: ssl.SSLSocket = conn
+        self.addr: Tuple[str, int] = addr
+        self.timer = engine.server.scheduler.call_later(
+            TLS_HANDSHAKE_TIMEOUT, self.__timed_out
+        )
+        engine.add_handler(conn, self.advance)
+
+    def advance(self, _: bool, __: bool) -> None:
+        engine = self.engine
+        try:
+            self.conn.do_handshake()
+        except ssl.SSLWantReadError:
+            engine.set_handler_writable(self.conn, self.advance, False)
+            return
+        except ssl.SSLWantWriteError:
+            engine.set_handler_writable(self.conn, self.advance, True)
+            return
+        except OSError as cause:
+            logger.info(
+                f"SSL handshake failed for {self.addr[0]}:{self.addr[1]}: {cause}"
+            )
+            self.__abort()
+            return
+        engine.selector.unregister(self.conn)
+        engine.server.scheduler.cancel(self.timer)
+        engine.server.metrics.increment("tls_handshakes")
+        if self.conn.session_reused:
+            engine.server.metrics.increment("tls_sessions_resumed")
+        engine.add_client(self.conn, self.addr)
+
+    def __abort(self) -> None:
+        self.engine.selector.unregister(self.conn)
+        self.engine.server.scheduler.cancel(self.timer)
+        self.conn.close()
+
+    def __timed_out(self) -> None:
+        logger.info(f"SSL handshake timed out for {self.addr[0]}:{self.addr[1]}")
+        self.engine.server.metrics.increment("tls_handshake_timeouts")
+        self.__abort()
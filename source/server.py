@@ -1,14 +1,26 @@
 from __future__ import annotations
+from .asyncio_engine import AsyncioEngine
 from .channel import Channel
+from .channel_log import ChannelLogWriter
 from .connected_client import ConnectedClient
 from .irc_helpers import irc_lower
+from .metrics import Metrics, read_listen_overflows
+from .motd import MOTDCache
+from .scheduler import Scheduler
+from .selector_engine import SelectorEngine
+from .state_store import StateStore
+from .wire_trace import is_not_wire_trace, WireTrace
+from .worker_bus import BusHub, WorkerBus
+from bisect import bisect_left, insort
 from loguru import logger
 from optparse import Values
-from select import select
-from time import time
 from typing import List
+import atexit
 import os
+import re
+import signal
 import socket
+import ssl
 import sys
 
 
@@ -22,6 +34,9 @@ class Server(object):
         self.ipv6: bool = options.ipv6 or False
         self.debug: bool = options.debug or False
         self.channel_log_dir: str | None = options.channel_log_dir
+        self.channel_log_max_bytes: int = options.channel_log_max_size * 1024 * 1024
+        # Only started once the server is running, see `start`.
+        self.channel_log_writer: ChannelLogWriter | None = None
         self.chroot: str | None = options.chroot
         self.setuid: List[int] | None = options.setuid
         self.state_dir: str | None = options.state_dir
@@ -29,13 +44,37 @@ class Server(object):
         self.log_max_bytes: int = options.log_max_size * 1024 * 1024
         self.log_count: int = options.log_count or 0
         self.respect_web: bool = options.respect_web or False
+        self.join_snapshot: bool = options.join_snapshot or False
+        self.metrics_interval: int = options.metrics_interval or 0
+        self.sendq_soft_limit: int = options.sendq_soft_limit * 1024
+        self.sendq_hard_limit: int = options.sendq_hard_limit * 1024
+        self.workers: int = options.workers or 1
+        self.engine_name: str = options.engine
+        self.listen_backlog: int = options.listen_backlog
+        self.accept_batch: int = options.accept_batch
+        self.line_budget: int = options.line_budget
+        self.key_broadcast_window: float = options.key_broadcast_window
+        self.wire_trace = WireTrace(
+            options.wire_trace_file,
+            options.wire_trace_sample,
+            re.split(r"[,\s]+", options.wire_trace_nicknames or ""),
+        )
+        # Only set inside of a worker process, when running multiple workers.
+        self.bus: WorkerBus | None = None
+        # Only filled in inside of the bus hub.
+        self.__worker_pids: List[int] = []
+        # Timers for delayed work, driven by whichever engine is running.
+        self.scheduler = Scheduler()
+        self.metrics = Metrics()
+        self.motd = MOTDCache(self)
+        # The last host wide listen overflow count we've seen.
+        self.__listen_overflows: int | None = None
 
         if options.password_file:
             with open(options.password_file, "r") as fp:
                 self.password = fp.read().strip("\n")
 
-        if self.ssl_pem_file:
-            self.ssl = __import__("ssl")
+        self.ssl_context: ssl.SSLContext | None = None
 
         # Find certificate after daemonization if path is relative:
         if self.ssl_pem_file and os.path.exists(self.ssl_pem_file):
@@ -56,16 +95,25 @@ class Server(object):
         self.channels: dict[
             str, Channel
         ] = {}  # irc_lower(Channel name) --> Channel instance.
+        # irc_lower(Channel name), sorted, for LIST.
+        self.channel_index: List[str] = []
         self.clients: dict[
             socket.socket, ConnectedClient
         ] = {}  # Socket --> Client instance.
         self.nicknames: dict[
             str, ConnectedClient
         ] = {}  # irc_lower(Nickname) --> Client instance.
+        # Only created once the server starts, see `start`.
+        self.engine: SelectorEngine | AsyncioEngine
         if self.channel_log_dir:
             self.__create_directory_if_not_exists(self.channel_log_dir)
         if self.state_dir:
             self.__create_directory_if_not_exists(self.state_dir)
+            self.state_store: StateStore | None = StateStore(
+                self, self.state_dir, options.state_flush_interval
+            )
+        else:
+            self.state_store: StateStore | None = None
 
     def client_changed_nickname(
         self,
@@ -76,6 +124,14 @@ class Server(object):
         if old_nickname:
             del self.nicknames[irc_lower(old_nickname)]
         self.nicknames[irc_lower(new_nickname)] = client
+        for channel in client.channels.values():
+            channel.member_renamed(client, old_nickname, new_nickname)
+        client.update_wire_trace()
+
+    def client_count(self) -> int:
+        if self.bus is not None:
+            return len(self.bus.clients)
+        return len(self.clients)
 
     def daemonize(self) -> None:
         try:
@@ -105,6 +161,7 @@ class Server(object):
         else:
             channel = Channel(self, channel_name)
             self.channels[irc_lower(channel_name)] = channel
+            insort(self.channel_index, irc_lower(channel_name))
         return channel
 
     def get_client(self, nickname) -> ConnectedClient | None:
@@ -122,6 +179,12 @@ class Server(object):
     def has_channel(self, name: str) -> bool:
         return irc_lower(name) in self.channels
 
+    def owns(self, channel_name: str) -> bool:
+        """Whether this worker runs the channel, always true unless running
+        with --workers."""
+        bus = self.bus
+        return bus is None or bus.owner_of(channel_name) == bus.index
+
     def make_pid_file(self, filename: str) -> None:
         try:
             fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
@@ -138,10 +201,17 @@ class Server(object):
             x.remove_client(client)
         if client.nickname and irc_lower(client.nickname) in self.nicknames:
             del self.nicknames[irc_lower(client.nickname)]
-        del self.clients[client.socket]
+        if self.bus is not None:
+            self.bus.forget(client)
+        if client.socket in self.clients:
+            del self.clients[client.socket]
 
     def remove_channel(self, channel):
-        del self.channels[irc_lower(channel.name)]
+        key = irc_lower(channel.name)
+        del self.channels[key]
+        position = bisect_left(self.channel_index, key)
+        if position < len(self.channel_index) and self.channel_index[position] == key:
+            del self.channel_index[position]
 
     def remove_member_from_channel(
         self, client: ConnectedClient, channel_name: str
@@ -151,33 +221,62 @@ class Server(object):
             channel.remove_client(client)
 
     def start(self) -> None:
+        # Loaded before forking any workers so they all share the same session
+        # ticket keys, and can resume each others sessions.
+        pem_file = self.__find_ssl_pem_file()
+        if pem_file is not None:
+            self.ssl_context = self.__create_ssl_context(pem_file)
+        if self.workers > 1:
+            self.__start_workers()
+        else:
+            self.__create_engine()
         serversockets: List[socket.socket] = []
         for port in self.ports:
             s = socket.socket(
                 socket.AF_INET6 if self.ipv6 else socket.AF_INET, socket.SOCK_STREAM
             )
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.bus is not None:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             try:
                 s.bind((self.address, port))
             except socket.error as cause:
                 logger.critical(f"Could not bind port {port}: {cause}.")
                 sys.exit(1)
-            s.listen(5)
+            s.listen(self.listen_backlog)
+            s.setblocking(False)
             serversockets.append(s)
             del s
             logger.success(f"Listening on port {port}.")
-        if self.chroot:
-            os.chdir(self.chroot)
-            os.chroot(self.chroot)
-            logger.success(f"Changed root directory to {self.chroot}")
-        if self.setuid:
-            os.setgid(self.setuid[1])
-            os.setuid(self.setuid[0])
-            logger.success(f"Set uid:gid to {self.setuid[0]}:{self.setuid[1]}")
+        self.__drop_privileges()
+        if self.ssl_pem_file and self.ssl_context is None:
+            # Nowhere to be found from outside of the jail, so every worker
+            # ends up with session ticket keys of its own.
+            self.ssl_context = self.__create_ssl_context(self.ssl_pem_file)
 
         self.__init_logging()
+        if self.channel_log_dir:
+            # Threads don't survive forking, so every worker starts its own,
+            # which only logs the channels that worker owns.
+            self.channel_log_writer = ChannelLogWriter(
+                self.channel_log_dir, self.channel_log_max_bytes, self.log_count
+            )
+            self.channel_log_writer.start()
+            atexit.register(self.channel_log_writer.stop)
+        if self.state_store is not None:
+            atexit.register(self.state_store.flush)
+        # Exit through sys.exit, so that everything registered above with
+        # atexit still gets written out.
+        signal.signal(signal.SIGTERM, self.__terminate)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.__reload)
+        if self.metrics_interval > 0:
+            self.__listen_overflows = read_listen_overflows()
+            self.scheduler.call_later(self.metrics_interval, self.__log_metrics)
         try:
-            self.__run(serversockets)
+            self.engine.run(serversockets)
+        except SystemExit:
+            raise
         except:
             logger.critical("Fatal exception")
             raise
@@ -186,65 +285,147 @@ class Server(object):
         if not os.path.isdir(path):
             os.makedirs(path)
 
+    def __create_ssl_context(self, pem_file: str) -> ssl.SSLContext:
+        # One context for every connection means one session cache, and one set
+        # of session ticket keys, so reconnecting clients can resume cheaply.
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(pem_file, pem_file)
+        return context
+
+    def __find_ssl_pem_file(self) -> str | None:
+        """Where the --ssl-pem-file can be loaded from before changing the
+        root directory, which may mean looking for it inside of the jail."""
+        pem_file = self.ssl_pem_file
+        if not pem_file:
+            return None
+        if os.path.exists(pem_file):
+            return pem_file
+        if self.chroot:
+            # Relative paths are relative to the jail's root as well.
+            jailed = os.path.join(self.chroot, pem_file.lstrip("/"))
+            if os.path.exists(jailed):
+                return jailed
+        return None
+
+    def __create_engine(self) -> None:
+        if self.engine_name == "asyncio":
+            self.engine = AsyncioEngine(self)
+        else:
+            self.engine = SelectorEngine(self)
+
+    def __drop_privileges(self) -> None:
+        if self.chroot:
+            os.chdir(self.chroot)
+            os.chroot(self.chroot)
+            logger.success(f"Changed root directory to {self.chroot}")
+        if self.setuid:
+            os.setgid(self.setuid[1])
+            os.setuid(self.setuid[0])
+            logger.success(f"Set uid:gid to {self.setuid[0]}:{self.setuid[1]}")
+
     def __init_logging(self) -> None:
-        if not self.log_file:
-            return
         log_level = "INFO"
         if self.debug:
             log_level = "TRACE"
+        # Replaces loguru's default DEBUG level handler, so that debug messages
+        # (and the cost of formatting them) really are off without --debug.
+        logger.remove()
+        logger.add(sys.stderr, filter=is_not_wire_trace, level=log_level)
+        self.wire_trace.add_sink()
+        if not self.log_file:
+            return
+        if self.workers > 1:
+            # Every process appends to the same file, and one renaming it
+            # would leave the others writing to the old one, so rotating it is
+            # left to e.g. logrotate's copytruncate.
+            rotation = retention = None
+        else:
+            rotation = self.log_max_bytes
+            retention = self.log_count
         logger.add(
             self.log_file,
             compression=None,
             enqueue=True,
+            filter=is_not_wire_trace,
             format="{time:YYYY-MM-DD HH:mm:ss!UTC} - {name}[{process}] "
             + "- {level} - {message}",
             level=log_level,
-            rotation=self.log_max_bytes,
-            retention=self.log_count,
+            rotation=rotation,
+            retention=retention,
         )
 
-    def __run(self, serversockets: List[socket.socket]) -> None:
-        last_aliveness_check = time()
-        while True:
-            (iwtd, owtd, _ewtd) = select(
-                serversockets + [x.socket for x in self.clients.values()],
-                [x.socket for x in self.clients.values() if x.write_queue_size() > 0],
-                [],
-                10,
-            )
-            for x in iwtd:
-                if x in self.clients:
-                    self.clients[x].socket_readable_notification()
-                else:
-                    (conn, addr) = x.accept()
-                    if self.ssl_pem_file:
-                        try:
-                            conn = self.ssl.wrap_socket(
-                                conn,
-                                server_side=True,
-                                certfile=self.ssl_pem_file,
-                                keyfile=self.ssl_pem_file,
-                            )
-                        except Exception:
-                            logger.exception(
-                                f"SSL connection error for {addr[0]}:{addr[1]}"
-                            )
-                            continue
-                    try:
-                        self.clients[conn] = ConnectedClient(self, conn)
-                        logger.info(f"Accepted connection from {addr[0]}:{addr[1]}.")
-                    except socket.error as cause:
-                        logger.debug(f"socket error: {cause}")
-                        try:
-                            conn.close()
-                        except OSError:
-                            pass
-
-            for x in owtd:
-                if x in self.clients:  # client may have been disconnected
-                    self.clients[x].socket_writable_notification()
-            now = time()
-            if last_aliveness_check + 10 < now:
-                for client in list(self.clients.values()):
-                    client.check_aliveness()
-                last_aliveness_check = now
+    def __log_metrics(self) -> None:
+        listen_overflows = read_listen_overflows()
+        if listen_overflows is not None and self.__listen_overflows is not None:
+            if listen_overflows > self.__listen_overflows:
+                self.metrics.increment(
+                    "listen_overflows", listen_overflows - self.__listen_overflows
+                )
+            self.__listen_overflows = listen_overflows
+        if self.metrics.counters:
+            if self.bus is not None:
+                logger.info(
+                    f"Worker {self.bus.index} metrics: {self.metrics.summary()}"
+                )
+            else:
+                logger.info(f"Metrics: {self.metrics.summary()}")
+        self.scheduler.call_later(self.metrics_interval, self.__log_metrics)
+
+    def __terminate(self, _signal: int, _frame) -> None:
+        logger.info("Terminated.")
+        sys.exit(0)
+
+    def __reload(self, _signal: int, _frame) -> None:
+        logger.info("Reloading the MOTD.")
+        self.motd.invalidate()
+
+    def __reload_workers(self, _signal: int, _frame) -> None:
+        for pid in self.__worker_pids:
+            os.kill(pid, signal.SIGHUP)
+
+    def __terminate_workers(self, _signal: int, _frame) -> None:
+        logger.info("Terminated, stopping the workers.")
+        for pid in self.__worker_pids:
+            os.kill(pid, signal.SIGTERM)
+        # So that none of them sees the bus go away before its own SIGTERM.
+        for pid in self.__worker_pids:
+            os.waitpid(pid, 0)
+        sys.exit(0)
+
+    def __start_workers(self) -> None:
+        """Fork off every worker, and turn this process into the bus hub.
+
+        Only ever returns inside of a worker process.
+        """
+        pairs = [socket.socketpair() for _ in range(self.workers)]
+        pids = self.__worker_pids
+        for index, (_, worker_end) in enumerate(pairs):
+            pid = os.fork()
+            if pid == 0:
+                for hub_end, other_worker_end in pairs:
+                    hub_end.close()
+                    if other_worker_end is not worker_end:
+                        other_worker_end.close()
+                # Created after forking, so that no epoll instance is shared
+                # between workers (or with the hub).
+                self.__create_engine()
+                self.bus = WorkerBus(self, index, worker_end)
+                return
+            pids.append(pid)
+        for _, worker_end in pairs:
+            worker_end.close()
+        # Otherwise SIGHUP would kill the hub, instead of reloading the workers.
+        signal.signal(signal.SIGHUP, self.__reload_workers)
+        signal.signal(signal.SIGTERM, self.__terminate_workers)
+        self.__drop_privileges()
+        self.__init_logging()
+        logger.success(f"Started {self.workers} workers.")
+        try:
+            BusHub([hub_end for (hub_end, _) in pairs]).run()
+        finally:
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+        sys.exit(1)
@@ -0,0 +1,164 @@
+from __future__ import annotations
+from .irc_helpers import VALID_CHANNELNAME_REGEXP
+from loguru import logger
+from typing import Any, Dict, TYPE_CHECKING
+import ast
+import os
+import re
+import sqlite3
+
+# Avoid Circular imports.
+if TYPE_CHECKING:
+    from .channel import Channel
+    from .scheduler import Timer
+    from .server import Server
+
+DATABASE_FILE = "state.sqlite3"
+FIELDS = ("topic", "key", "serialized_lobby", "serialized_world_data")
+SCHEMA_VERSION = 1
+
+
+class StateStore(object):
+    """Write-behind persistence of channel state (topic, key, lobby data).
+
+    Everything lives in a single SQLite database (in WAL mode) under the state
+    directory, with one row per channel, looked up by name as channels get
+    created. Changes only mark the channel as dirty, and whatever the latest
+    state of every dirty channel is gets written out in a single transaction
+    every `interval` seconds (and on shutdown), so a channel that changes a
+    hundred times in between is only written once.
+
+    With --workers, the state of a channel only exists on the worker owning
+    the channel, which is the only one to ever load or save it.
+    """
+
+    def __init__(self, server: Server, directory: str, interval: float):
+        self.server: Server = server
+        self.directory: str = directory
+        self.interval: float = interval
+        # Channel name --> Channel
+        self.__dirty: Dict[str, Channel] = {}
+        self.__timer: Timer | None = None
+        # Opened on first use, so that every worker gets its own connection.
+        self.__connection: sqlite3.Connection | None = None
+
+    def flush(self) -> None:
+        self.server.scheduler.cancel(self.__timer)
+        self.__timer = None
+        (dirty, self.__dirty) = (self.__dirty, {})
+        if not dirty:
+            return
+        try:
+            self.__write(
+                {name: self.__snapshot(channel) for name, channel in dirty.items()}
+            )
+        except sqlite3.Error as cause:
+            logger.error(f"Could not save the state of {len(dirty)} channels: {cause}")
+            return
+        self.server.metrics.increment("state_writes", len(dirty))
+
+    def load(self, channel_name: str) -> Dict[str, Any] | None:
+        channel = self.__dirty.get(channel_name)
+        if channel is not None:
+            # Not written out yet, e.g. the channel emptied and was re-created.
+            return self.__snapshot(channel)
+        try:
+            row = (
+                self.__connect()
+                .execute(
+                    f"SELECT {', '.join(FIELDS)} FROM channels WHERE name = ?",
+                    (channel_name,),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as cause:
+            logger.error(f"Could not load the state of {channel_name}: {cause}")
+            return None
+        if row is None:
+            return None
+        return dict(zip(FIELDS, row))
+
+    def mark_dirty(self, channel: Channel) -> None:
+        self.__dirty[channel.name] = channel
+        self.server.metrics.increment("state_changes")
+        if self.__timer is None:
+            self.__timer = self.server.scheduler.call_later(self.interval, self.flush)
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__connection is not None:
+            return self.__connection
+        connection = sqlite3.connect(f"{self.directory}/{DATABASE_FILE}", timeout=10)
+        connection.execute("PRAGMA journal_mode = WAL")
+        # Still atomic, and still survives the process crashing, only a power
+        # loss can lose the last few transactions.
+        connection.execute("PRAGMA synchronous = NORMAL")
+        self.__connection = connection
+        (version,) = connection.execute("PRAGMA user_version").fetchone()
+        if version < SCHEMA_VERSION:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS channels (name TEXT PRIMARY KEY,"
+                    f" {', '.join(f'{field} TEXT' for field in FIELDS)})"
+                    " WITHOUT ROWID"
+                )
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.__import_state_files()
+        return connection
+
+    def __import_state_files(self) -> None:
+        """Copies the state out of the one file per channel that was used
+        before this database, the first time the database gets created."""
+        states: Dict[str, Dict[str, Any]] = {}
+        for filename in os.listdir(self.directory):
+            # Skips the database itself, and any temporary files left behind.
+            if not VALID_CHANNELNAME_REGEXP.match(filename):
+                continue
+            try:
+                with open(f"{self.directory}/{filename}") as state_file:
+                    data = self.__parse_state_file(state_file.read())
+            except (OSError, UnicodeDecodeError) as cause:
+                logger.warning(f"Skipping unreadable state file {filename}: {cause}")
+                continue
+            # Undo the escaping of "/" into "_" (and "_" into "__").
+            name = re.sub("__?", lambda m: "_" if m.group() == "__" else "/", filename)
+            states[name] = data
+        if states:
+            self.__write(states)
+            logger.success(f"Imported the state of {len(states)} channels.")
+
+    def __write(self, states: Dict[str, Dict[str, Any]]) -> None:
+        """Saves the state of any number of channels in one transaction."""
+        connection = self.__connect()
+        with connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO channels (name, {', '.join(FIELDS)})"
+                f" VALUES (?{', ?' * len(FIELDS)})",
+                [
+                    (name, *(state.get(field) for field in FIELDS))
+                    for name, state in states.items()
+                ],
+            )
+
+    def __parse_state_file(self, text: str) -> Dict[str, Any]:
+        """Reads the `field = value` lines of an old state file, without
+        running it. Values were written out with str() rather than repr(), so
+        anything that isn't a string literal or None is taken as is."""
+        data: Dict[str, Any] = {}
+        for line in text.splitlines():
+            (field, separator, value) = line.partition(" = ")
+            if not separator or field not in FIELDS:
+                continue
+            try:
+                parsed = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                parsed = value
+            data[field] = parsed if parsed is None or isinstance(parsed, str) else value
+        return data
+
+    def __snapshot(self, channel: Channel) -> Dict[str, Any]:
+        return {
+            "topic": channel.topic,
+            "key": channel.key,
+            "serialized_lobby": channel.serialized_lobby,
+            "serialized_world_data": channel.serialized_world_data,
+        }
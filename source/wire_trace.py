@@ -0,0 +1,63 @@
+from __future__ import annotations
+from .irc_helpers import irc_lower
+from itertools import count
+from loguru import logger
+from typing import List, Set, TYPE_CHECKING
+
+# Avoid Circular imports.
+if TYPE_CHECKING:
+    from .connected_client import ConnectedClient
+
+
+def is_wire_trace(record: dict) -> bool:
+    return "wire_trace" in record["extra"]
+
+
+def is_not_wire_trace(record: dict) -> bool:
+    return "wire_trace" not in record["extra"]
+
+
+class WireTrace(object):
+    """Records everything sent and received by a handful of connections (every
+    Nth one, and anyone using one of the given nicknames) to a separate sink,
+    so traffic can be looked at in production without logging everyone."""
+
+    def __init__(self, file: str | None, sample: int, nicknames: List[str]):
+        self.file: str | None = file
+        self.sample: int = sample
+        # irc_lower(Nickname)
+        self.nicknames: Set[str] = {
+            irc_lower(nickname) for nickname in nicknames if nickname
+        }
+        self.__connections = count(1)
+        self.__logger = logger.bind(wire_trace=True)
+
+    def add_sink(self) -> None:
+        if self.file:
+            logger.add(
+                self.file,
+                enqueue=True,
+                filter=is_wire_trace,
+                format="{time:YYYY-MM-DD HH:mm:ss.SSS!UTC} [{process}] {message}",
+            )
+
+    def record(self, client: ConnectedClient, direction: str, data) -> None:
+        self.__logger.info(
+            "[{}:{}] ({}) {} {!r}",
+            client.host,
+            client.port,
+            client.nickname,
+            direction,
+            data,
+        )
+
+    def sample_connection(self) -> bool:
+        """Whether a new connection is one of the 1 in N to be traced."""
+        if not self.file or not self.sample:
+            return False
+        return next(self.__connections) % self.sample == 0
+
+    def wants_nickname(self, nickname: str | None) -> bool:
+        if not self.file or not nickname:
+            return False
+        return irc_lower(nickname) in self.nicknames
@@ -0,0 +1,410 @@
+from __future__ import annotations
+from .connected_client import ConnectedClient, SENDMSG_MAX_CHUNKS
+from .irc_helpers import irc_lower, VALID_CHANNELNAME_REGEXP
+from .message import Message
+from collections import deque
+from itertools import islice
+from loguru import logger
+from typing import Deque, Dict, List, TYPE_CHECKING
+from zlib import crc32
+import json
+import selectors
+import socket
+import sys
+
+# Avoid Circular imports.
+if TYPE_CHECKING:
+    from .channel import Channel
+    from .scheduler import Timer
+    from .server import Server
+
+# Commands changing state that every worker keeps a copy of, which every
+# worker runs.
+REPLICATED_COMMANDS = frozenset(("NICK", "PASS", "QUIT", "USER", "WALLOPS"))
+# Commands that only the worker owning the channel they name first runs.
+CHANNEL_COMMANDS = frozenset(
+    (
+        "GETCHANKEY",
+        "GETCKEY",
+        "JOIN",
+        "MODE",
+        "NAMES",
+        "NOTICE",
+        "PART",
+        "PRIVMSG",
+        "SETCHANKEY",
+        "SETCKEY",
+        "TOPIC",
+        "UTM",
+        "WHO",
+    )
+)
+# Where an event published to every worker is headed.
+EVERYONE = b"*"
+
+
+class SendQueue(object):
+    """Bytes waiting to be sent on a non-blocking socket, queued up as they
+    come without copying, the first chunk of which has already been partially
+    sent up to `offset`."""
+
+    __slots__ = ("chunks", "offset")
+
+    def __init__(self):
+        self.chunks: Deque[bytes] = deque()
+        self.offset = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.chunks)
+
+    def append(self, data: bytes) -> None:
+        self.chunks.append(data)
+
+    def send(self, sock: socket.socket) -> None:
+        queue = self.chunks
+        chunks = list(islice(queue, 0, SENDMSG_MAX_CHUNKS))
+        if self.offset:
+            chunks[0] = memoryview(chunks[0])[self.offset :]
+        try:
+            sent = sock.sendmsg(chunks) + self.offset
+        except BlockingIOError:
+            return
+        while queue and sent >= len(queue[0]):
+            sent -= len(queue.popleft())
+        self.offset = sent
+
+
+class RemoteClient(ConnectedClient):
+    """A replica of a client that is connected to another worker, its home.
+
+    Replicated events (connections, NICK, QUIT, ...) are applied by every
+    worker, each of which only writes to its own clients, so whatever gets
+    written to a replica then is dropped. Anything else only runs on a single
+    worker, so what gets written to a replica then is forwarded to its home.
+    """
+
+    def __init__(self, server: Server, client_id: str, host: str, port: int):
+        super().__init__(server, None, (host, port))
+        self.client_id = client_id
+        self.home: int = int(client_id.split(":")[0])
+
+    def add_encoded_to_write_buffer(self, data: bytes, low_priority=False) -> None:
+        bus: WorkerBus = self.server.bus  # type: ignore
+        if not bus.replicating:
+            bus.deliver(self, data, low_priority)
+
+    def disconnect(self, quitmsg) -> None:
+        bus: WorkerBus = self.server.bus  # type: ignore
+        if bus.replicating:
+            self.server.remove_client(self, quitmsg)
+        else:
+            # Only its home can close the connection.
+            bus.send(self.home, self, "kick", str(quitmsg))
+
+
+class WorkerBus(object):
+    """The workers end of the bus.
+
+    Every channel is owned by one of the workers, picked by the hash of its
+    name. Lines a client sends are routed by the worker it is connected to:
+    channel commands to the owner of the channel, which runs the handler and
+    the fan-out, and the rest to the worker itself, except for those changing
+    state every worker keeps a copy of (see `REPLICATED_COMMANDS`), which go to
+    everyone. Either way they go through the hub, so they're applied in the
+    order the client sent them. Owners publish who joins and leaves their
+    channels, so that every worker knows who shares a channel with its own
+    clients, and which channels there are.
+    """
+
+    def __init__(self, server: Server, index: int, sock: socket.socket):
+        self.server: Server = server
+        self.index: int = index
+        self.socket: socket.socket = sock
+        self.socket.setblocking(False)
+        # Whether the event being applied is one that every worker applies.
+        self.replicating: bool = False
+        # Client ID --> Client instance, for both local clients and replicas.
+        self.clients: dict[str, ConnectedClient] = {}
+        # Home worker --> [Encoded data, Client IDs, Low priority] to forward,
+        # in the order they were written.
+        self.__deliveries: Dict[int, List[list]] = {}
+        self.__delivery_timer: Timer | None = None
+        self.__next_client_id = 0
+        self.__readbuffer = b""
+        self.__writequeue = SendQueue()
+        server.engine.add_handler(self.socket, self.notification)
+
+    def attach(self, client: ConnectedClient) -> None:
+        client.client_id = f"{self.index}:{self.__next_client_id}"
+        self.__next_client_id += 1
+        self.clients[client.client_id] = client
+        self.publish(client, "connect", client.host, client.port)
+
+    def deliver(self, client: RemoteClient, data: bytes, low_priority: bool) -> None:
+        """Forwards data written to a replica to its home, batched up with
+        whatever else goes there before the next loop iteration."""
+        batches = self.__deliveries.get(client.home)
+        if batches is None:
+            batches = self.__deliveries[client.home] = []
+            if self.__delivery_timer is None:
+                self.__delivery_timer = self.server.scheduler.call_soon(
+                    self.__deliveries_due
+                )
+        if batches and batches[-1][0] is data and batches[-1][2] == low_priority:
+            # The same line going out to yet another channel member.
+            batches[-1][1].append(client.client_id)
+        else:
+            batches.append([data, [client.client_id], low_priority])
+
+    def forget(self, client: ConnectedClient) -> None:
+        self.clients.pop(client.client_id or "", None)
+
+    def joined(self, client: ConnectedClient, channel: Channel) -> None:
+        self.publish(client, "joined", channel.name, channel.topic)
+
+    def owner_of(self, channel_name: str) -> int:
+        return crc32(irc_lower(channel_name).encode()) % self.server.workers
+
+    def parted(self, client: ConnectedClient, channel: Channel) -> None:
+        self.publish(client, "parted", channel.name)
+
+    def publish(self, client: ConnectedClient | None, kind: str, *arguments) -> None:
+        """Sends an event to every worker, this one included."""
+        self.__queue(
+            EVERYONE, [self.index, kind, client and client.client_id, *arguments]
+        )
+
+    def route(self, client: ConnectedClient, message: Message, line: str) -> None:
+        """Sends a line one of our clients sent to whichever workers run it."""
+        command = message.command
+        if command in REPLICATED_COMMANDS:
+            self.publish(client, "line", line)
+            return
+        if command not in CHANNEL_COMMANDS:
+            self.send(self.index, client, "line", line)
+            return
+        arguments = message.arguments
+        if not arguments:
+            if command == "NAMES":
+                for channel_name in sorted(client.channels):
+                    self.__send_line(client, channel_name, f"NAMES {channel_name}")
+            else:
+                self.send(self.index, client, "line", line)
+            return
+        target = arguments[0]
+        if command == "JOIN" and target == "0":
+            # Every worker parts the channels it owns.
+            for index in range(self.server.workers):
+                self.send(index, client, "line", line)
+        elif "," in target and command in ("JOIN", "NAMES", "PART"):
+            self.__route_channel_list(client, command, arguments)
+        else:
+            self.__send_line(client, target, line)
+
+    def send(
+        self, worker: int, client: ConnectedClient | None, kind: str, *arguments
+    ) -> None:
+        """Sends an event to a single worker."""
+        self.__queue(
+            str(worker).encode(),
+            [self.index, kind, client and client.client_id, *arguments],
+        )
+
+    def topic_changed(self, channel: Channel) -> None:
+        self.publish(None, "topic", channel.name, channel.topic)
+
+    def notification(self, readable: bool, writable: bool) -> None:
+        if readable:
+            try:
+                data = self.socket.recv(2**16)
+            except OSError as cause:
+                logger.critical(f"Lost the connection to the worker bus: {cause}")
+                sys.exit(1)
+            if not data:
+                logger.critical("Worker bus closed, shutting down.")
+                sys.exit(1)
+            self.__readbuffer += data
+            (*lines, self.__readbuffer) = self.__readbuffer.split(b"\n")
+            for line in lines:
+                (destination, _, event) = line.partition(b" ")
+                self.__apply(destination == EVERYONE, json.loads(event))
+        if writable and self.__writequeue:
+            self.__writequeue.send(self.socket)
+            if not self.__writequeue:
+                self.server.engine.set_handler_writable(
+                    self.socket, self.notification, False
+                )
+
+    def __apply(self, replicated: bool, event: list) -> None:
+        (origin, kind, client_id, *arguments) = event
+        client = self.clients.get(client_id)
+        server = self.server
+        self.replicating = replicated
+        try:
+            if kind == "connect":
+                if origin != self.index:
+                    self.clients[client_id] = RemoteClient(
+                        server, client_id, arguments[0], arguments[1]
+                    )
+            elif kind == "deliver":
+                self.__deliver_locally(*arguments)
+            elif kind == "topic":
+                channel = server.channels.get(irc_lower(arguments[0]))
+                if channel is not None and not channel.owned:
+                    channel.topic = arguments[1]
+            elif client is None:
+                # Already removed by an earlier event, e.g. kicked by a handler
+                # before its own quit made it back around.
+                pass
+            elif kind in ("line", "kick") and not (
+                client.socket is None or client.socket in server.clients
+            ):
+                # A client of ours that has disconnected, but whose quit hasn't
+                # made it back around yet.
+                pass
+            elif kind == "line":
+                client.handle_line(arguments[0])
+            elif kind == "quit":
+                server.remove_client(client, arguments[0])
+            elif kind == "kick":
+                client.disconnect(arguments[0])
+            elif origin == self.index:
+                # The owner has already (un)done the membership itself.
+                pass
+            elif kind == "joined":
+                channel = server.get_channel(arguments[0])
+                channel.topic = arguments[1]
+                channel.add_member(client)
+                client.channels[irc_lower(arguments[0])] = channel
+            elif kind == "parted":
+                if client.channels.pop(irc_lower(arguments[0]), None) is not None:
+                    server.remove_member_from_channel(client, arguments[0])
+        finally:
+            self.replicating = False
+
+    def __deliver_locally(
+        self, data: str, low_priority: bool, client_ids: List[str]
+    ) -> None:
+        encoded = data.encode()
+        local_clients = self.server.clients
+        for client_id in client_ids:
+            client = self.clients.get(client_id)
+            if client is not None and client.socket in local_clients:
+                client.add_encoded_to_write_buffer(encoded, low_priority)
+
+    def __deliveries_due(self) -> None:
+        self.__delivery_timer = None
+        self.__send_deliveries()
+
+    def __queue(self, destination: bytes, event: list) -> None:
+        if self.__deliveries:
+            # Whatever was written before this event goes out before it.
+            self.server.scheduler.cancel(self.__delivery_timer)
+            self.__delivery_timer = None
+            self.__send_deliveries()
+        if not self.__writequeue:
+            self.server.engine.set_handler_writable(
+                self.socket, self.notification, True
+            )
+        self.__writequeue.append(
+            destination + b" " + json.dumps(event).encode() + b"\n"
+        )
+
+    def __route_channel_list(
+        self, client: ConnectedClient, command: str, arguments: List[str]
+    ) -> None:
+        """Splits up e.g. `JOIN #a,#b key` into a line per channel, each of
+        which goes to the owner of that channel."""
+        channel_names = arguments[0].split(",")
+        if command == "JOIN":
+            keys = arguments[1].split(",") if len(arguments) > 1 else []
+            keys.extend((len(channel_names) - len(keys)) * [""])
+            for channel_name, key in zip(channel_names, keys):
+                line = f"JOIN {channel_name} {key}" if key else f"JOIN {channel_name}"
+                self.__send_line(client, channel_name, line)
+        elif command == "PART":
+            partmsg = f" :{arguments[1]}" if len(arguments) > 1 else ""
+            for channel_name in channel_names:
+                self.__send_line(client, channel_name, f"PART {channel_name}{partmsg}")
+        else:
+            for channel_name in channel_names:
+                self.__send_line(client, channel_name, f"NAMES {channel_name}")
+
+    def __send_deliveries(self) -> None:
+        (deliveries, self.__deliveries) = (self.__deliveries, {})
+        for worker, batches in deliveries.items():
+            for data, client_ids, low_priority in batches:
+                self.__queue(
+                    str(worker).encode(),
+                    [
+                        self.index,
+                        "deliver",
+                        None,
+                        data.decode(),
+                        low_priority,
+                        client_ids,
+                    ],
+                )
+
+    def __send_line(
+        self, client: ConnectedClient, channel_name: str, line: str
+    ) -> None:
+        if VALID_CHANNELNAME_REGEXP.match(channel_name):
+            worker = self.owner_of(channel_name)
+        else:
+            # Not a channel after all (e.g. PRIVMSG to a nickname).
+            worker = self.index
+        self.send(worker, client, "line", line)
+
+
+class BusHub(object):
+    """Runs in the parent process, and forwards the events from each worker to
+    the workers they're headed for (all of them, or a single one), in the
+    order they were sent."""
+
+    def __init__(self, sockets: List[socket.socket]):
+        self.selector = selectors.DefaultSelector()
+        self.sockets: List[socket.socket] = sockets
+        # Socket --> Pending bytes.
+        self.readbuffers: dict[socket.socket, bytes] = {}
+        self.writequeues: dict[socket.socket, SendQueue] = {}
+        for sock in sockets:
+            sock.setblocking(False)
+            self.readbuffers[sock] = b""
+            self.writequeues[sock] = SendQueue()
+            self.selector.register(sock, selectors.EVENT_READ)
+
+    def run(self) -> None:
+        while True:
+            for key, mask in self.selector.select():
+                sock: socket.socket = key.fileobj  # type: ignore
+                if mask & selectors.EVENT_READ:
+                    data = sock.recv(2**16)
+                    if not data:
+                        logger.critical("A worker exited, shutting down.")
+                        return
+                    self.__forward(sock, data)
+                if mask & selectors.EVENT_WRITE:
+                    self.writequeues[sock].send(sock)
+                    if not self.writequeues[sock]:
+                        self.selector.modify(sock, selectors.EVENT_READ)
+
+    def __forward(self, origin: socket.socket, data: bytes) -> None:
+        buffer = self.readbuffers[origin] + data
+        end = buffer.rfind(b"\n") + 1
+        self.readbuffers[origin] = buffer[end:]
+        if not end:
+            return
+        # Socket --> Lines headed for it.
+        batches: Dict[socket.socket, List[bytes]] = {}
+        for line in buffer[: end - 1].split(b"\n"):
+            destination = line[: line.index(b" ")]
+            if destination == EVERYONE:
+                for sock in self.sockets:
+                    batches.setdefault(sock, []).append(line)
+            else:
+                batches.setdefault(self.sockets[int(destination)], []).append(line)
+        for sock, lines in batches.items():
+            if not self.writequeues[sock]:
+                self.selector.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+            self.writequeues[sock].append(b"\n".join(lines) + b"\n")